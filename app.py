@@ -1,13 +1,117 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
 import json
 import os
+import sys
+import gc
 import random
 import math
+import itertools
+import threading
+import queue
+import multiprocessing
+import unicodedata
+import mmap
+import struct
+import zlib
+import gzip
+import io
+import heapq
+import tempfile
+import time
+from array import array
+from collections import OrderedDict, defaultdict
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import ProcessPoolExecutor
 
 app = Flask(__name__)
 
 # --- CONFIGURATION ---
-DATA_FILE = 'books_data.json'
+DATA_FILE = 'books_data.json'         # JSON: chỉ dùng để nhập (lần chạy đầu) / xuất dữ liệu
+SNAPSHOT_FILE = 'books_data.bin'      # Snapshot nhị phân, nạp nhanh khi khởi động
+WAL_FILE = 'books_data.wal'           # Nhật ký ghi trước (append-only), gộp định kỳ vào SNAPSHOT_FILE
+WAL_COMPACT_BYTES = 1024 * 1024       # Gộp log vào snapshot khi log vượt ngưỡng này
+INDEXED_FIELDS = ('tac_gia', 'ten_sach')  # Chỉ mục phụ (B-Tree) theo tác giả / tên sách
+PAGE_FILE = None                      # vd. 'books_data.pages': lưu node thành trang trên đĩa (mmap) thay vì giữ cả cây trong RAM
+BUFFER_POOL_PAGES = 1024              # Số trang giữ trong buffer pool (LRU) khi bật PAGE_FILE
+IMPORT_CHUNK = 200_000                # Số bản ghi sắp xếp trong RAM mỗi lượt khi nhập file lớn (external sort)
+PROGRESS_EVERY = 100_000              # Báo tiến độ nhập sau mỗi ngần này bản ghi
+BUILD_WORKERS = 1                     # >1: dựng lại cây phân trang bằng nhiều tiến trình (mỗi tiến trình một dải khóa)
+PARALLEL_BUILD_MIN = 200_000          # Dưới số sách này, dựng tuần tự (chi phí khởi tạo tiến trình không đáng)
+PAYLOAD_CACHE_ENTRIES = 64            # Số payload GET (theo version cây) giữ sẵn đã serialize / nén
+GZIP_MIN_BYTES = 1024                 # Chỉ nén gzip payload lớn hơn ngưỡng này
+STREAM_QUEUE_STEPS = 32               # Số bước chờ gửi tối đa khi stream (đầy thì các bước sau được gộp, thao tác không chờ client)
+BATCH_MERGE_RATIO = 0.125             # Lô >= tỉ lệ này * số sách: trộn với dữ liệu cũ rồi dựng lại cây (bulk_load)
+KEY_CODEC_PREFIX = None               # vd. 'BK-': mã so sánh theo số (BK-9999 < BK-10000), chỉ nhận mã <prefix><số>; không dùng cùng PAGE_FILE
+BOOK_ID_MAX = 9999                    # Mã sinh tự động (random / generate_bulk): BK-0001..BK-9999
+METRICS_ENABLED = True                # False: bộ đếm / đo giờ thành lời gọi rỗng (/api/metrics chỉ còn số liệu của cây)
+
+# --- METRICS ---
+class Metrics:
+    """
+    Process-wide counters and timers, exported in Prometheus text format by /api/metrics.
+    Names may carry labels ('btree_node_visits_total{op="search"}'). A timer is a summary:
+    '<name>_count' calls and '<name>_sum' seconds, inclusive of nested timers.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(lambda: [0, 0.0])
+
+    def inc(self, name, n=1):
+        if not self.enabled: return
+        with self._lock: self.counters[name] += n      # Các luồng đọc chạy song song (RWLock)
+
+    def observe(self, name, seconds):
+        if not self.enabled: return
+        with self._lock:    # _count và _sum phải luôn đi cùng nhau
+            t = self.timers[name]
+            t[0] += 1
+            t[1] += seconds
+
+    def timed(self, name, gate=None):
+        """
+        Decorator: counts calls and wall time; a plain call while metrics are disabled.
+        With `gate` (an attribute name) only calls whose first argument has it set are counted.
+        """
+        def wrap(fn):
+            @wraps(fn)
+            def inner(*args, **kwargs):
+                if not self.enabled or (gate and not getattr(args[0], gate)): return fn(*args, **kwargs)
+                t0 = time.perf_counter()
+                try: return fn(*args, **kwargs)
+                finally: self.observe(name, time.perf_counter() - t0)
+            return inner
+        return wrap
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def render(self, gauges=(), counters=()):
+        """Prometheus text exposition: the counters (plus extra `counters`), the timers, then `gauges` as (name, value) pairs."""
+        with self._lock:
+            counters = {**self.counters, **dict(counters)}
+            timers = {k: tuple(v) for k, v in self.timers.items()}
+        lines, typed = [], set()
+        def emit(kind, key, value, suffix=''):
+            base, brace, labels = key.partition('{')
+            if base not in typed:
+                typed.add(base)
+                lines.append(f"# TYPE {base} {kind}")
+            lines.append(f"{base}{suffix}{brace}{labels} {value:.9g}" if isinstance(value, float) else f"{base}{suffix}{brace}{labels} {value}")
+        for key in sorted(counters): emit('counter', key, counters[key])
+        for key in sorted(timers):
+            emit('summary', key, timers[key][0], '_count')
+            emit('summary', key, timers[key][1], '_sum')
+        for key, value in gauges: emit('gauge', key, value)
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics(METRICS_ENABLED)
 
 # --- 0. DATA GENERATOR (Vietnamese Context) ---
 LIBRARY_DATA = {
@@ -20,69 +124,269 @@ LIBRARY_DATA = {
 
 # --- 1. CLASS DEFINITIONS ---
 
+def _key_of(other):
+    """ma_sach of a Book (or of anything carrying one), otherwise the value itself as a string."""
+    key = getattr(other, 'ma_sach', other)
+    return key if type(key) is str else str(key)
+
+
 class Book:
     """
     Represents a Book entity.
     Implements comparison operators based on 'ma_sach' (Book ID) for B-Tree ordering.
+    Slotted (no per-instance __dict__); author names repeat a lot, so they are interned.
     """
+    __slots__ = ('ma_sach', 'ten_sach', 'tac_gia')
+
     def __init__(self, ma_sach, ten_sach, tac_gia):
         self.ma_sach = str(ma_sach).strip() 
         self.ten_sach = ten_sach
-        self.tac_gia = tac_gia
+        self.tac_gia = sys.intern(tac_gia) if type(tac_gia) is str else tac_gia
     
     def to_dict(self):
         return {'ma_sach': self.ma_sach, 'ten_sach': self.ten_sach, 'tac_gia': self.tac_gia}
     
     # Operator Overloading for easy comparison
-    def __lt__(self, other): return self.ma_sach < (other.ma_sach if isinstance(other, Book) else str(other))
-    def __gt__(self, other): return self.ma_sach > (other.ma_sach if isinstance(other, Book) else str(other))
-    def __eq__(self, other): return self.ma_sach == (other.ma_sach if isinstance(other, Book) else str(other))
-    def __le__(self, other): return self.ma_sach <= (other.ma_sach if isinstance(other, Book) else str(other))
-    def __ge__(self, other): return self.ma_sach >= (other.ma_sach if isinstance(other, Book) else str(other))
+    def __lt__(self, other): return self.ma_sach < _key_of(other)
+    def __gt__(self, other): return self.ma_sach > _key_of(other)
+    def __eq__(self, other): return self.ma_sach == _key_of(other)
+    def __le__(self, other): return self.ma_sach <= _key_of(other)
+    def __ge__(self, other): return self.ma_sach >= _key_of(other)
 
 
+_node_ids = itertools.count(1)
+_DUPLICATE = object()   # _insert_recursive result: key already exists, nothing was changed
+_versions = itertools.count(1)  # Dùng chung mọi cây: cây thay thế (import, đổi m, reset) luôn có version lớn hơn
+
 class BTreeNode:
     """
     Represents a Node in the B-Tree.
+    Each node gets a stable 'id' so animation steps can refer to it by delta.
     """
+    __slots__ = ('id', 'keys', 'ids', 'children', 'leaf', 'size')
+    encode_key = None   # KeyCodec.encode on the node class of a tree built with a codec (ids hold encoded keys)
+
     def __init__(self, leaf=True):
+        self.id = next(_node_ids)
         self.keys = []      # List of Book objects
-        self.children = []  # List of BTreeNode objects
+        self.ids = []       # ma_sach (or its encoded key) of each key, parallel to keys (searched with bisect)
+        self.children = () if leaf else []  # BTreeNode objects (in memory) or page ids (paged tree); leaves share ()
         self.leaf = leaf    # Boolean: True if leaf node
+        self.size = 0       # Number of keys in this subtree (order statistics)
+
+    def recount(self, resolve=None):
+        """Recomputes 'size' from own keys and children's sizes (O(m)). resolve maps page ids to nodes."""
+        children = map(resolve, self.children) if resolve else self.children
+        self.size = len(self.keys) + sum(c.size for c in children)
+
+    # Key mutations keep 'keys' and 'ids' in step
+    def set_keys(self, keys):
+        self.keys = keys
+        encode = self.encode_key
+        self.ids = [k.ma_sach for k in keys] if encode is None else [encode(k.ma_sach) for k in keys]
+
+    def insert_key(self, i, book):
+        self.keys.insert(i, book)
+        self.ids.insert(i, book.ma_sach if self.encode_key is None else self.encode_key(book.ma_sach))
+
+    def pop_key(self, i=-1):
+        self.ids.pop(i)
+        return self.keys.pop(i)
+
+    def set_key(self, i, book):
+        self.keys[i] = book
+        self.ids[i] = book.ma_sach if self.encode_key is None else self.encode_key(book.ma_sach)
     
-    def to_dict(self):
+    def to_dict(self, resolve=None):
+        children = map(resolve, self.children) if resolve else self.children
         return {
+            'id': self.id,
             'keys': [k.to_dict() for k in self.keys],
             'leaf': self.leaf,
-            'children': [child.to_dict() for child in self.children]
+            'children': [child.to_dict(resolve) for child in children]
         }
 
+    def to_delta(self):
+        """Shallow form of the node: children are referenced by id only."""
+        return {
+            'id': self.id,
+            'keys': [k.to_dict() for k in self.keys],
+            'leaf': self.leaf,
+            'children': [child if isinstance(child, int) else child.id for child in self.children]
+        }
+
+
+# --- KEY CODEC ---
+class NumericKeyCodec:
+    """
+    Optional BTree key codec for ids of the form <prefix><digits> (e.g. 'BK-0042'). Node ids hold
+    number * 128 + 2 * digit count: ints compare faster than strings and follow numeric order
+    (BK-9999 < BK-10000); the digit count keeps 'BK-42' and 'BK-0042' apart. Odd values fall between
+    two ids and serve as range bounds. Books, messages and the API keep the original strings.
+    """
+    MAX_DIGITS = 18
+    LOW, HIGH = -1, 1 << 80     # Trước / sau mọi mã hợp lệ
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.node_class = type('NumericKeyNode', (BTreeNode,), {'__slots__': (), 'encode_key': staticmethod(self.encode)})
+
+    def encode(self, ma_sach):
+        """Key of a valid id; any other string maps to the bound at its place in string order (never a stored key)."""
+        s, p = str(ma_sach), self.prefix
+        if not s.startswith(p): return self.LOW if s < p else self.HIGH
+        digits = s[len(p):]
+        n = len(digits) - len(digits.lstrip('0123456789'))
+        if n > self.MAX_DIGITS: return self.HIGH
+        if not n: return self.LOW if digits < '0' else self.HIGH
+        key = int(digits[:n]) * 128 + 2 * n
+        return key if n == len(digits) else key + 1     # 'BK-0100\uffff': ngay sau BK-0100
+
+    def check(self, ma_sach):
+        """Encoded key of a storable id; ValueError otherwise."""
+        key = self.encode(ma_sach)
+        if key % 2 or key == self.HIGH: raise ValueError(f"Mã '{ma_sach}' không đúng dạng {self.prefix}<số> (tối đa {self.MAX_DIGITS} chữ số)")
+        return key
+
+def _key_codec():
+    return NumericKeyCodec(KEY_CODEC_PREFIX) if KEY_CODEC_PREFIX else None
+
+if KEY_CODEC_PREFIX and PAGE_FILE: raise ValueError("KEY_CODEC_PREFIX chưa hỗ trợ cây phân trang: tắt PAGE_FILE hoặc bỏ KEY_CODEC_PREFIX")
+
+
+class _OpContext(threading.local):
+    """Per-thread state of the operation in progress (each request gets its own step log)."""
+    def __init__(self):
+        self.steps_log = []
+        self.affected_nodes = set()
+        self.dirty = set()
+        self.trace = True
+        self.sink = None    # Hàm nhận từng bước ngay khi ghi (stream_steps); None: giữ cả log trong steps_log
+
+
+def _page_op(fn):
+    """Runs a mutating BTree method as one buffer-pool operation: the pages it touches stay pinned."""
+    @wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if self.pool is None: return fn(self, *args, **kwargs)
+        with self.pool.operation(self.root): result = fn(self, *args, **kwargs)
+        if self.pool.needs_checkpoint(): self.checkpoint()
+        return result
+    return wrapper
+
 
 class BTree:
     """
     Main B-Tree Logic Class.
     Includes methods for Search, Insert, Delete, and Visualization logging.
+    With a BufferPool the nodes live in a page file and children hold page ids.
     """
-    def __init__(self, m=5):
-        self.root = BTreeNode(leaf=True)
+    def __init__(self, m=5, step_mode='delta', pool=None, codec=None, instrument=True):
+        if codec is not None and pool is not None: raise ValueError("Key codec chưa hỗ trợ cây phân trang (PAGE_FILE)")
+        self.pool = pool
+        self.codec = codec          # None: ids là chính chuỗi ma_sach (thứ tự chuỗi)
+        self._key = str if codec is None else codec.encode     # Khóa so sánh của một mã / cận khoảng
+        self._node_class = BTreeNode if codec is None else codec.node_class
+        if pool is not None and pool.file.root:
+            self.root = pool.get(pool.file.root)
+            self.node_count = pool.file.node_count
+        else:
+            self.root = self._new_node(leaf=True)
+            self.node_count = 1     # Maintained on split/merge/root changes (no full walk per query)
         self.m = m
         self.max_keys = m - 1
         self.min_keys = math.ceil(m / 2) - 1
-        self.affected_nodes = set() # To highlight modified nodes in UI
-        self.steps_log = []         # To store animation steps for Frontend
+        self.step_mode = step_mode  # 'delta': 1 snapshot gốc + thay đổi từng bước | 'full': snapshot mỗi bước
+        self.instrument = instrument    # False: không đếm vào metrics (cây của chỉ mục phụ)
+        self._visits = 0                # Số node insert/delete đang chạy đã đọc (chỉ một luồng ghi): cộng vào metrics một lần
+        self.indexes = {}           # field -> SecondaryIndex, kept in step on insert/delete
+        self.id_allocator = None    # IdAllocator (mã trống cho random / generate_bulk), cũng được báo khi insert/delete
+        self.version = next(_versions)  # Tăng sau mỗi thay đổi nội dung (ETag của /api/tree, /api/books)
+        self._ctx = _OpContext()    # steps_log / affected_nodes / _dirty / trace: riêng cho từng luồng
+
+    # --- PER-THREAD OPERATION CONTEXT ---
+    @property
+    def steps_log(self):
+        """Animation steps of this thread's last operation (for the Frontend)."""
+        return self._ctx.steps_log
+    @steps_log.setter
+    def steps_log(self, value): self._ctx.steps_log = value
+
+    @property
+    def affected_nodes(self):
+        """Nodes modified by this thread's last operation (highlighted in the UI)."""
+        return self._ctx.affected_nodes
+    @affected_nodes.setter
+    def affected_nodes(self, value): self._ctx.affected_nodes = value
+
+    @property
+    def _dirty(self):
+        """Nodes changed since the last captured step."""
+        return self._ctx.dirty
+    @_dirty.setter
+    def _dirty(self, value): self._ctx.dirty = value
+
+    @property
+    def trace(self):
+        """False = chế độ im lặng: không tạo message/snapshot/affected_nodes."""
+        return self._ctx.trace
+    @trace.setter
+    def trace(self, value): self._ctx.trace = value
+
+    @property
+    def size(self):
+        """Number of books (root subtree size)."""
+        return self.root.size
+
+    # --- NODE ACCESS (in memory or through the buffer pool) ---
+    def _get(self, ref): return ref if self.pool is None else self.pool.get(ref)
+    def _child(self, node, i): return self._get(node.children[i])
+    def _ref(self, node): return node if self.pool is None else node.id
+    @property
+    def _resolve(self):
+        """Read-only page resolver for recount/to_dict (None for an in-memory tree)."""
+        return None if self.pool is None else self.pool.read
+
+    def _new_node(self, leaf):
+        return self._node_class(leaf=leaf) if self.pool is None else self.pool.new_node(leaf)
+
+    def _free_node(self, node):
+        if self.pool is not None: self.pool.free(node)
+
+    def checkpoint(self):
+        """Paged tree: writes dirty pages and atomically commits the new root."""
+        if self.pool is not None: self.pool.checkpoint(self.root, self.node_count)
+
+    def close(self):
+        if self.pool is not None: self.pool.file.close()
+
+    def _touch(self, *nodes):
+        """Marks nodes as changed: highlighted in the UI and sent in the next delta step."""
+        self.affected_nodes.update(nodes)
+        self._dirty.update(nodes)
 
     # --- [UPDATED] CAPTURE STATE WITH FOUND KEYS ---
+    @metrics.timed('btree_capture_state_seconds', gate='instrument')
     def capture_state(self, message, highlight_nodes=None, found_keys=None):
         """
         Captures the current state of the tree for animation.
         NEW: found_keys param allows persisting highlighted results.
+        In 'delta' mode only the first step of an operation carries the full tree;
+        later steps carry the nodes touched since the previous step and the root id.
         """
         snapshot = {
-            'tree': self.root.to_dict(),
             'message': message,
             'highlights': [],
             'found_keys': [] # Mới: Lưu danh sách key tìm được
         }
+        if self.step_mode == 'full' or not self.steps_log:
+            snapshot['tree'] = self.root.to_dict(self._resolve)
+        else:
+            snapshot['delta'] = {
+                'root': self.root.id,
+                'nodes': [n.to_delta() for n in self._dirty]
+            }
+        self._dirty = set()
         
         # Xử lý highlight nodes (như cũ)
         if highlight_nodes:
@@ -95,66 +399,83 @@ class BTree:
         if found_keys:
             snapshot['found_keys'] = [k.ma_sach for k in found_keys]
             
+        if self._ctx.sink is not None:
+            self._ctx.sink(snapshot)
+            snapshot = None     # Đã gửi đi: chỉ giữ chỗ để delta biết bước đầu đã có
         self.steps_log.append(snapshot)
 
     # --- SEARCH OPERATIONS ---
     def search(self, ma_sach, node=None):
         """Standard Search (Internal check)."""
         if node is None: node = self.root
-        i = 0
-        ma_sach = str(ma_sach)
-        while i < len(node.keys) and ma_sach > node.keys[i].ma_sach: i += 1
-        if i < len(node.keys) and ma_sach == node.keys[i].ma_sach: return node.keys[i]
-        if node.leaf: return None
-        return self.search(ma_sach, node.children[i])
+        key, pool, visits, found = self._key(ma_sach), self.pool, 1, None
+        while True:
+            i = bisect_left(node.ids, key)
+            if i < len(node.ids) and node.ids[i] == key:
+                found = node.keys[i]
+                break
+            if node.leaf: break
+            node = node.children[i] if pool is None else pool.get(node.children[i])
+            visits += 1
+        if self.instrument and metrics.enabled: metrics.inc('btree_node_visits_total{op="search"}', visits)   # Đường nóng nhất: tránh cả lời gọi khi tắt
+        return found
 
-    def search_with_animation(self, ma_sach):
-        """Search with step-by-step logging."""
+    def search_with_animation(self, ma_sach, trace=True):
+        """Search with step-by-step logging (trace=False: plain search, no steps)."""
         self.steps_log = [] 
+        self._dirty = set()
+        self.trace = trace
         node = self.root
-        ma_sach = str(ma_sach)
+        ma_sach, key = str(ma_sach), self._key(ma_sach)
         step_count = 1
         while True:
-            keys_str = ", ".join([k.ma_sach for k in node.keys])
-            self.capture_state(f"🔍 <b>Bước {step_count}:</b> Xét Node <code>[{keys_str}]</code>.", highlight_nodes=node)
-            i = 0
-            while i < len(node.keys) and ma_sach > node.keys[i].ma_sach: i += 1
+            if self.instrument: metrics.inc('btree_node_visits_total{op="search"}')
+            if self.trace:
+                keys_str = ", ".join([k.ma_sach for k in node.keys])
+                self.capture_state(f"🔍 <b>Bước {step_count}:</b> Xét Node <code>[{keys_str}]</code>.", highlight_nodes=node)
+            i = bisect_left(node.ids, key)
             
-            if i < len(node.keys) and ma_sach == node.keys[i].ma_sach:
-                self.capture_state(f"✅ <b>TÌM THẤY:</b> Khóa <b>{ma_sach}</b>.", highlight_nodes=node)
+            if i < len(node.ids) and node.ids[i] == key:
+                if self.trace: self.capture_state(f"✅ <b>TÌM THẤY:</b> Khóa <b>{ma_sach}</b>.", highlight_nodes=node)
                 return node.keys[i]
             
             if node.leaf:
-                self.capture_state(f"❌ <b>Kết thúc:</b> Không tìm thấy.", highlight_nodes=node)
+                if self.trace: self.capture_state(f"❌ <b>Kết thúc:</b> Không tìm thấy.", highlight_nodes=node)
                 return None
             
-            direction = ""
-            if i == 0: direction = f"nhỏ hơn {node.keys[0].ma_sach}"
-            elif i == len(node.keys): direction = f"lớn hơn {node.keys[-1].ma_sach}"
-            else: direction = f"giữa {node.keys[i-1].ma_sach} và {node.keys[i].ma_sach}"
-
-            self.capture_state(f"⬇️ <b>Đi xuống:</b> Vì {ma_sach} {direction}, xuống nhánh {i}.", highlight_nodes=[node, node.children[i]])
-            node = node.children[i]
+            if self.trace:
+                direction = ""
+                if i == 0: direction = f"nhỏ hơn {node.keys[0].ma_sach}"
+                elif i == len(node.keys): direction = f"lớn hơn {node.keys[-1].ma_sach}"
+                else: direction = f"giữa {node.keys[i-1].ma_sach} và {node.keys[i].ma_sach}"
+                self.capture_state(f"⬇️ <b>Đi xuống:</b> Vì {ma_sach} {direction}, xuống nhánh {i}.", highlight_nodes=[node, self._child(node, i)])
+            node = self._child(node, i)
             step_count += 1
 
     # --- BATCH OPTIMIZED RANGE SEARCH (KEY FEATURE) ---
-    def search_range_optimized(self, min_val, max_val):
+    def search_range_optimized(self, min_val, max_val, trace=True):
         """
         Performs a range search using batch processing and branch pruning.
+        With trace=False no steps or statistics are produced and the summary is None.
         """
         self.steps_log = []
-        results = []
+        self._dirty = set()
+        self.trace = trace
         min_val, max_val = str(min_val).strip(), str(max_val).strip()
+        if not self.trace:
+            return list(self.iter_range(min_val, max_val)), None
         
+        results = []
         stats = {
-            'total_nodes': self._count_nodes(self.root), 
+            'total_nodes': self.node_count, 
             'visited_nodes': 0, 
             'visited_ids': set()
         }
 
         self.capture_state(f"🚀 <b>Range Search (Batch Mode):</b> <b>{min_val}</b> ➜ <b>{max_val}</b>.<br>Tổng kho: {stats['total_nodes']} trang dữ liệu.")
+        io_before = (self.pool.faults, self.pool.hits) if self.pool else None
         
-        self._search_range_batch(self.root, min_val, max_val, results, stats)
+        self._search_range_batch(self.root, self._key(min_val), self._key(max_val), results, stats)
         
         # Calculate Efficiency Summary
         visited = len(stats['visited_ids'])
@@ -166,6 +487,9 @@ class BTree:
             f"📊 <b>Hiệu năng B-Tree:</b> Chỉ đọc {visited}/{total} nodes.<br>"
             f"⚡ <b>Tối ưu (Bỏ qua):</b> {eff:.2f}% khối lượng dữ liệu."
         )
+        if io_before:
+            faults, hits = self.pool.faults - io_before[0], self.pool.hits - io_before[1]
+            summary_msg += f"<br>💾 <b>Buffer pool:</b> {faults} lần đọc đĩa (page fault), {hits} lần trúng cache."
         
         # --- [UPDATED] Pass 'results' to highlight them permanently ---
         if results:
@@ -176,399 +500,2080 @@ class BTree:
         return results, summary_msg
 
     def _search_range_batch(self, node, min_val, max_val, results, stats):
-        if id(node) not in stats['visited_ids']:
-            stats['visited_ids'].add(id(node))
+        if node.id not in stats['visited_ids']:
+            stats['visited_ids'].add(node.id)
             stats['visited_nodes'] += 1
 
-        start_idx = 0
-        while start_idx < len(node.keys) and node.keys[start_idx].ma_sach < min_val:
-            start_idx += 1
-            
-        end_idx = start_idx
-        while end_idx < len(node.keys) and node.keys[end_idx].ma_sach <= max_val:
-            end_idx += 1
+        start_idx = bisect_left(node.ids, min_val)
+        end_idx = max(start_idx, bisect_right(node.ids, max_val))
         
         matched_keys_in_node = node.keys[start_idx:end_idx]
         
         if matched_keys_in_node:
-            keys_display = ", ".join([k.ma_sach for k in matched_keys_in_node])
             results.extend(matched_keys_in_node) 
-            self.capture_state(
-                f"⚡ <b>Batch Scan (Disk I/O):</b> Tại Node này, lấy liền {len(matched_keys_in_node)} cuốn: <b>[{keys_display}]</b>", 
-                highlight_nodes=[node] 
-            )
+            if self.trace:
+                keys_display = ", ".join([k.ma_sach for k in matched_keys_in_node])
+                self.capture_state(
+                    f"⚡ <b>Batch Scan (Disk I/O):</b> Tại Node này, lấy liền {len(matched_keys_in_node)} cuốn: <b>[{keys_display}]</b>", 
+                    highlight_nodes=[node] 
+                )
 
         if not node.leaf:
-            self._search_range_batch(node.children[start_idx], min_val, max_val, results, stats)
+            self._search_range_batch(self._child(node, start_idx), min_val, max_val, results, stats)
             for i in range(start_idx + 1, end_idx + 1):
                 if i < len(node.children):
-                     self._search_range_batch(node.children[i], min_val, max_val, results, stats)
+                     self._search_range_batch(self._child(node, i), min_val, max_val, results, stats)
 
-    def _count_nodes(self, node):
-        if not node: return 0
-        count = 1
-        if not node.leaf:
-            for child in node.children:
-                count += self._count_nodes(child)
-        return count
+    # --- RANGE CURSOR ---
+    def iter_range(self, min_val=None, max_val=None, after=None):
+        """
+        Lazy in-order cursor over [min_val, max_val], optionally resuming strictly after `after`.
+        Seeks once in O(log N) with an explicit stack, then streams forward in amortized O(1)
+        per key. Do not mutate the tree while a cursor is open.
+        """
+        stack = []
+        node, child_at, key = self.root, self._child, self._key
+        if min_val is not None: min_val = key(min_val)
+        if max_val is not None: max_val = key(max_val)
+        if after is not None: after = key(after)
+        while True:
+            i = 0
+            if min_val is not None: i = bisect_left(node.ids, min_val)
+            if after is not None: i = max(i, bisect_right(node.ids, after))
+            stack.append((node, i))
+            if node.leaf: break
+            node = child_at(node, i)
+
+        while stack:
+            node, i = stack.pop()
+            if i >= len(node.keys): continue
+            if max_val is not None and node.ids[i] > max_val: return
+            yield node.keys[i]
+            stack.append((node, i + 1))
+            if not node.leaf:
+                child = child_at(node, i + 1)
+                while True:
+                    stack.append((child, 0))
+                    if child.leaf: break
+                    child = child_at(child, 0)
+
+    # --- MULTI-KEY QUERIES ---
+    def multi_get(self, keys):
+        """
+        Point lookups for many keys in one traversal. The sorted, de-duplicated keys are split among
+        the children of each node, so a shared path is read once and untouched subtrees are skipped.
+        Returns ({ma_sach: Book or None}, stats); stats['baseline'] is what one search() per key would read.
+        """
+        names = sorted({str(k).strip() for k in keys}, key=self._key)
+        keys = [self._key(k) for k in names]
+        found, stats = dict.fromkeys(names), {'visited': 0, 'baseline': 0}
+        def walk(node, lo, hi):
+            stats['visited'] += 1
+            stats['baseline'] += hi - lo
+            ids, j = node.ids, lo
+            while j < hi:
+                i = bisect_left(ids, keys[j])
+                end = j
+                while end < hi and (i == len(ids) or keys[end] < ids[i]): end += 1   # Cùng rơi vào nhánh i
+                if end > j and not node.leaf: walk(self._child(node, i), j, end)
+                if end < hi and keys[end] == ids[i]:
+                    found[names[end]] = node.keys[i]
+                    end += 1
+                j = end
+        if keys: walk(self.root, 0, len(keys))
+        return found, stats
+
+    def multi_range(self, intervals):
+        """
+        Several [min, max] ranges in one in-order traversal. Overlapping ranges are merged first; each
+        node only descends into the children some range intersects, handing each child its own ranges.
+        Returns (one list of books per input interval, stats) with stats as in multi_get
+        (the baseline is one range walk per merged range).
+        """
+        intervals = [(self._key(str(lo).strip()), self._key(str(hi).strip())) for lo, hi in intervals]
+        merged = []
+        for lo, hi in sorted(iv for iv in intervals if iv[0] <= iv[1]):
+            if merged and lo <= merged[-1][1]: merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+            else: merged.append((lo, hi))
+        out, stats = [], {'visited': 0, 'baseline': 0}
+        def walk(node, a, b):
+            stats['visited'] += 1
+            stats['baseline'] += b - a
+            ids, leaf = node.ids, node.leaf
+            pending = None      # (nhánh con, khoảng đầu tiên cần nó): chờ vì khoảng sau có thể dùng chung nhánh
+            for j in range(a, b):
+                lo, hi = merged[j]
+                s = bisect_left(ids, lo)
+                e = max(s, bisect_right(ids, hi))
+                if pending is not None and pending[0] != s:
+                    walk(self._child(node, pending[0]), pending[1], j)
+                    pending = None
+                if pending is None and not leaf: pending = (s, j)
+                if e > s:
+                    if not leaf: walk(self._child(node, s), pending[1], j + 1)
+                    for i in range(s, e):
+                        out.append(node.keys[i])
+                        if not leaf and i + 1 < e: walk(self._child(node, i + 1), j, j + 1)
+                    pending = (e, j) if not leaf else None
+            if pending is not None: walk(self._child(node, pending[0]), pending[1], b)
+        if merged: walk(self.root, 0, len(merged))
+        ids = [self._key(b.ma_sach) for b in out]
+        return [out[bisect_left(ids, lo):bisect_right(ids, hi)] for lo, hi in intervals], stats
 
     # --- INSERT OPERATIONS ---
-    def insert(self, book):
+    @_page_op
+    def insert(self, book, trace=True):
+        """Inserts in a single descent. Returns False (tree untouched) if ma_sach already exists."""
+        key = self.check_book(book)
         self.steps_log = []
         self.affected_nodes = set()
-        if self.search(book.ma_sach): return 
+        self._dirty = set()
+        self.trace = trace
 
-        self.capture_state(f"🚀 <b>Thêm mới:</b> Chèn {book.ten_sach} ({book.ma_sach}).")
+        if self.trace: self.capture_state(f"🚀 <b>Thêm mới:</b> Chèn {book.ten_sach} ({book.ma_sach}).")
         
-        result = self._insert_recursive(self.root, book)
+        self._visits = 0
+        result = self._insert_recursive(self.root, book, key)
+        if self.instrument: metrics.inc('btree_node_visits_total{op="insert"}', self._visits)
         
+        if result is _DUPLICATE:
+            if self.trace: self.capture_state(f"⛔ <b>Mã trùng:</b> {book.ma_sach} đã tồn tại. Không thay đổi.")
+            return False
         if result:
             median_key, new_child = result
-            new_root = BTreeNode(leaf=False)
-            new_root.keys = [median_key]
-            new_root.children = [self.root, new_child]
+            new_root = self._new_node(leaf=False)
+            new_root.set_keys([median_key])
+            new_root.children = [self._ref(self.root), self._ref(new_child)]
+            new_root.recount(self._resolve)
             self.root = new_root
-            self.capture_state(f"🌳 <b>Tách Gốc:</b> Gốc cũ tách đôi. Gốc mới chứa <b>{median_key.ma_sach}</b>.", [self.root, self.root.children[0], new_child])
+            self.node_count += 1
+            if self.instrument: metrics.inc('btree_height_changes_total{direction="grow"}')
+            if self.trace:
+                self._touch(new_root)
+                self.capture_state(f"🌳 <b>Tách Gốc:</b> Gốc cũ tách đôi. Gốc mới chứa <b>{median_key.ma_sach}</b>.", [self.root, self._child(self.root, 0), new_child])
         else:
-            self.capture_state(f"🏁 <b>Hoàn tất:</b> Cây ổn định.", [self.root])
+            if self.trace: self.capture_state(f"🏁 <b>Hoàn tất:</b> Cây ổn định.", [self.root])
+        for idx in self.indexes.values(): idx.add(book)
+        if self.id_allocator is not None: self.id_allocator.add(book)
+        self.version = next(_versions)
+        return True
 
-    def _insert_recursive(self, node, book):
-        i = 0
-        while i < len(node.keys) and book.ma_sach > node.keys[i].ma_sach: i += 1
+    def _insert_recursive(self, node, book, key):
+        self._visits += 1
+        i = bisect_left(node.ids, key)
+        if i < len(node.ids) and node.ids[i] == key: return _DUPLICATE
             
         if node.leaf:
-            node.keys.insert(i, book) 
-            self.affected_nodes.add(node)
-            self.capture_state(f"📥 <b>Chèn vào Lá:</b> Đặt <b>{book.ma_sach}</b> vào vị trí {i}.", [node])
+            node.insert_key(i, book)
+            node.size += 1
+            if self.trace:
+                self._touch(node)
+                self.capture_state(f"📥 <b>Chèn vào Lá:</b> Đặt <b>{book.ma_sach}</b> vào vị trí {i}.", [node])
             
             if len(node.keys) > self.max_keys:
-                self.capture_state(f"⚠️ <b>Tràn (Overflow):</b> {len(node.keys)} khóa (Max={self.max_keys}). Tách node...", [node])
+                if self.trace: self.capture_state(f"⚠️ <b>Tràn (Overflow):</b> {len(node.keys)} khóa (Max={self.max_keys}). Tách node...", [node])
                 return self._split_node(node)
             return None
         else:
-            direction = ""
-            if i == 0: direction = f"nhỏ hơn {node.keys[0].ma_sach}"
-            elif i == len(node.keys): direction = f"lớn hơn {node.keys[-1].ma_sach}"
-            else: direction = f"giữa {node.keys[i-1].ma_sach} và {node.keys[i].ma_sach}"
-
-            self.capture_state(f"⬇️ <b>Tìm vị trí:</b> {book.ma_sach} {direction} -> Xuống nhánh {i}.", highlight_nodes=[node, node.children[i]])
+            if self.trace:
+                direction = ""
+                if i == 0: direction = f"nhỏ hơn {node.keys[0].ma_sach}"
+                elif i == len(node.keys): direction = f"lớn hơn {node.keys[-1].ma_sach}"
+                else: direction = f"giữa {node.keys[i-1].ma_sach} và {node.keys[i].ma_sach}"
+                self.capture_state(f"⬇️ <b>Tìm vị trí:</b> {book.ma_sach} {direction} -> Xuống nhánh {i}.", highlight_nodes=[node, self._child(node, i)])
 
-            result = self._insert_recursive(node.children[i], book)
+            result = self._insert_recursive(self._child(node, i), book, key)
+            if result is _DUPLICATE: return result
+            node.size += 1
             if result:
                 median, new_child = result
-                node.keys.insert(i, median)
-                node.children.insert(i + 1, new_child)
-                self.affected_nodes.add(node)
-                self.capture_state(f"✂️ <b>Tách thành công:</b> Cha nhận khóa <b>{median.ma_sach}</b>.", [node, node.children[i], new_child])
+                node.insert_key(i, median)
+                node.children.insert(i + 1, self._ref(new_child))
+                if self.trace:
+                    self._touch(node)
+                    self.capture_state(f"✂️ <b>Tách thành công:</b> Cha nhận khóa <b>{median.ma_sach}</b>.", [node, self._child(node, i), new_child])
                 
                 if len(node.keys) > self.max_keys:
-                    self.capture_state(f"⚠️ <b>Tràn cha:</b> Cha cũng đầy. Tách tiếp.", [node])
+                    if self.trace: self.capture_state(f"⚠️ <b>Tràn cha:</b> Cha cũng đầy. Tách tiếp.", [node])
                     return self._split_node(node)
             return None
 
+    def check_book(self, book):
+        """Key of a book about to be stored; ValueError if the page file or the key codec cannot hold it."""
+        if self.pool is not None: self.pool.file.check_book(book)
+        return book.ma_sach if self.codec is None else self.codec.check(book.ma_sach)
+
+    @metrics.timed('btree_split_seconds', gate='instrument')
     def _split_node(self, node):
         mid = len(node.keys) // 2
         median = node.keys[mid]
-        self.capture_state(f"✨ <b>Trung vị:</b> Đẩy khóa <b>{median.ma_sach}</b> lên.", [node])
+        if self.trace: self.capture_state(f"✨ <b>Trung vị:</b> Đẩy khóa <b>{median.ma_sach}</b> lên.", [node])
 
-        new_node = BTreeNode(leaf=node.leaf)
-        new_node.keys = node.keys[mid + 1:]
-        node.keys = node.keys[:mid]
+        new_node = self._new_node(leaf=node.leaf)
+        self.node_count += 1
+        new_node.set_keys(node.keys[mid + 1:])
+        node.keys, node.ids = node.keys[:mid], node.ids[:mid]
         
         if not node.leaf:
             new_node.children = node.children[mid + 1:]
             node.children = node.children[:mid + 1]
+        node.recount(self._resolve)
+        new_node.recount(self._resolve)
         
-        self.affected_nodes.update([node, new_node])
+        if self.trace: self._touch(node, new_node)
         return median, new_node
 
     # --- DELETE OPERATIONS ---
-    def delete(self, ma_sach):
+    @_page_op
+    def delete(self, ma_sach, trace=True):
+        """Deletes in a single descent. Returns the removed Book, or False if ma_sach does not exist."""
         self.steps_log = [] 
         self.affected_nodes = set()
+        self._dirty = set()
+        self.trace = trace
         ma_sach = str(ma_sach)
         
-        self.capture_state(f"🗑️ <b>Yêu cầu Xóa:</b> {ma_sach}")
-        if not self.search(ma_sach): 
-            self.capture_state(f"❌ Không tìm thấy.")
+        if self.trace: self.capture_state(f"🗑️ <b>Yêu cầu Xóa:</b> {ma_sach}")
+        self._visits = 0
+        removed = self._delete_recursive(self.root, self._key(ma_sach))
+        if self.instrument: metrics.inc('btree_node_visits_total{op="delete"}', self._visits)
+        if removed is None:
+            if self.trace: self.capture_state(f"❌ Không tìm thấy.")
             return False
-            
-        self._delete_recursive(self.root, ma_sach)
+        for idx in self.indexes.values(): idx.remove(removed)
+        if self.id_allocator is not None: self.id_allocator.remove(removed)
+        self.version = next(_versions)
         
         if len(self.root.keys) == 0 and not self.root.leaf:
-            new_root = self.root.children[0]
+            new_root = self._child(self.root, 0)
+            self._free_node(self.root)
             self.root = new_root
-            self.affected_nodes.add(self.root)
-            self.capture_state(f"📉 <b>Hạ gốc:</b> Gốc rỗng. Con lên làm <b>Gốc Mới</b>.", [self.root])
+            self.node_count -= 1
+            if self.instrument: metrics.inc('btree_height_changes_total{direction="shrink"}')
+            if self.trace:
+                self.affected_nodes.add(self.root)
+                self.capture_state(f"📉 <b>Hạ gốc:</b> Gốc rỗng. Con lên làm <b>Gốc Mới</b>.", [self.root])
         
-        self.capture_state("✅ <b>Xóa hoàn tất.</b>", [self.root])
-        return True
+        if self.trace: self.capture_state("✅ <b>Xóa hoàn tất.</b>", [self.root])
+        return removed
 
-    def _delete_recursive(self, node, ma_sach):
-        i = 0
-        while i < len(node.keys) and ma_sach > node.keys[i].ma_sach: i += 1
-        self.affected_nodes.add(node)
+    def _delete_recursive(self, node, key):
+        """Removes the key (as stored in node.ids) from the subtree; returns the removed Book or None if absent."""
+        self._visits += 1
+        i = bisect_left(node.ids, key)
+        if self.trace: self.affected_nodes.add(node)
         
-        if i < len(node.keys) and ma_sach == node.keys[i].ma_sach:
+        if i < len(node.ids) and node.ids[i] == key:
+            removed = node.keys[i]
+            ma_sach = removed.ma_sach
+            node.size -= 1
             if node.leaf:
-                self.capture_state(f"🎯 <b>Xóa tại Lá:</b> Xóa trực tiếp <b>{ma_sach}</b>.", [node])
-                node.keys.pop(i)
+                if self.trace: self.capture_state(f"🎯 <b>Xóa tại Lá:</b> Xóa trực tiếp <b>{ma_sach}</b>.", [node])
+                node.pop_key(i)
+                if self.trace: self._touch(node)
             else:
-                self.capture_state(
-                    f"👑 <b>Node Trong:</b> Khóa <b>{ma_sach}</b> cần tìm người thay thế (Tiền nhiệm/Kế nhiệm).", 
-                    highlight_nodes=[node] 
-                )
-                if len(node.children[i].keys) > self.min_keys:
-                    pred_key = self._get_predecessor(node, i)
-                    node.keys[i] = pred_key                    
+                if self.trace:
                     self.capture_state(
-                        f"👻 <b>Sao chép:</b> Đưa <b>{pred_key.ma_sach}</b> lên. Bản gốc bên dưới thành 'Bóng ma' chờ xóa.", 
-                        highlight_nodes=[node, node.children[i]]
+                        f"👑 <b>Node Trong:</b> Khóa <b>{ma_sach}</b> cần tìm người thay thế (Tiền nhiệm/Kế nhiệm).", 
+                        highlight_nodes=[node] 
                     )
+                if len(self._child(node, i).keys) > self.min_keys:
+                    pred_key = self._get_predecessor(node, i)
+                    node.set_key(i, pred_key)
+                    if self.trace:
+                        self._touch(node)
+                        self.capture_state(
+                            f"👻 <b>Sao chép:</b> Đưa <b>{pred_key.ma_sach}</b> lên. Bản gốc bên dưới thành 'Bóng ma' chờ xóa.", 
+                            highlight_nodes=[node, self._child(node, i)]
+                        )
                     
-                    self._delete_recursive(node.children[i], pred_key.ma_sach)
-                elif len(node.children[i+1].keys) > self.min_keys:
+                    self._delete_recursive(self._child(node, i), self._key(pred_key.ma_sach))
+                    j = i
+                elif len(self._child(node, i + 1).keys) > self.min_keys:
                     succ_key = self._get_successor(node, i)
-                    node.keys[i] = succ_key
-                    self.capture_state(
-                        f"👻 <b>Sao chép (Bóng ma):</b> Chép <b>{succ_key.ma_sach}</b> từ dưới lên. Bản gốc thành 'Bóng ma' chờ xóa.", 
-                        highlight_nodes=[node, node.children[i+1]]
-                    )
-                    self._delete_recursive(node.children[i+1], succ_key.ma_sach)
+                    node.set_key(i, succ_key)
+                    if self.trace:
+                        self._touch(node)
+                        self.capture_state(
+                            f"👻 <b>Sao chép (Bóng ma):</b> Chép <b>{succ_key.ma_sach}</b> từ dưới lên. Bản gốc thành 'Bóng ma' chờ xóa.", 
+                            highlight_nodes=[node, self._child(node, i + 1)]
+                        )
+                    self._delete_recursive(self._child(node, i + 1), self._key(succ_key.ma_sach))
+                    j = i + 1
                 else:
-                    child = node.children[i]
-                    sibling = node.children[i+1]
-                    self.capture_state(f"🔗 <b>Xóa & Gộp:</b> Xóa <b>{ma_sach}</b> khỏi cha, gộp 2 con.", [node, child, sibling])
-                    
-                    child.keys.extend(sibling.keys)
-                    if not child.leaf: child.children.extend(sibling.children)
-                    
-                    node.keys.pop(i)
-                    node.children.pop(i+1)
-                    self.affected_nodes.update([node, child])
-                    
-                    self.capture_state(f"✅ <b>Gộp xong:</b> Node con mới chứa {len(child.keys)} khóa.", [child])
+                    # Cả 2 con đều tối thiểu: vẫn lấy tiền nhiệm, con trái sẽ thiếu và được gộp lại bên dưới
+                    pred_key = self._get_predecessor(node, i)
+                    node.set_key(i, pred_key)
+                    if self.trace:
+                        self._touch(node)
+                        self.capture_state(
+                            f"🔗 <b>Xóa & Gộp:</b> Hai con đều tối thiểu. Đưa <b>{pred_key.ma_sach}</b> lên, con trái sẽ được gộp.", 
+                            highlight_nodes=[node, self._child(node, i), self._child(node, i + 1)]
+                        )
+                    self._delete_recursive(self._child(node, i), self._key(pred_key.ma_sach))
+                    j = i
+                if len(self._child(node, j).keys) < self.min_keys:
+                    if self.trace: self.capture_state(f"⚠️ <b>Thiếu hụt:</b> Con {j} thiếu khóa.", [self._child(node, j)])
+                    self._fix_child(node, j)
+            return removed
         else:
-            if node.leaf: return 
-            self.capture_state(f"⬇️ <b>Đi xuống:</b> Nhánh {i}.", [node.children[i]])
-            self._delete_recursive(node.children[i], ma_sach)
-            if len(node.children[i].keys) < self.min_keys:
-                self.capture_state(f"⚠️ <b>Thiếu hụt:</b> Con {i} thiếu khóa.", [node.children[i]])
+            if node.leaf: return None
+            if self.trace: self.capture_state(f"⬇️ <b>Đi xuống:</b> Nhánh {i}.", [self._child(node, i)])
+            removed = self._delete_recursive(self._child(node, i), key)
+            if removed is None: return None
+            node.size -= 1
+            if len(self._child(node, i).keys) < self.min_keys:
+                if self.trace: self.capture_state(f"⚠️ <b>Thiếu hụt:</b> Con {i} thiếu khóa.", [self._child(node, i)])
                 self._fix_child(node, i)
+            return removed
 
     def _fix_child(self, parent, i):
-        if i > 0 and len(parent.children[i-1].keys) > self.min_keys:
+        if i > 0 and len(self._child(parent, i - 1).keys) > self.min_keys:
             self._borrow_from_prev(parent, i)
-        elif i < len(parent.children)-1 and len(parent.children[i+1].keys) > self.min_keys:
+        elif i < len(parent.children)-1 and len(self._child(parent, i + 1).keys) > self.min_keys:
             self._borrow_from_next(parent, i)
         else:
             if i < len(parent.children) - 1: self._merge(parent, i)
             else: self._merge(parent, i-1)
 
+    @metrics.timed('btree_borrow_seconds{side="prev"}', gate='instrument')
     def _borrow_from_prev(self, parent, i):
-        child = parent.children[i]
-        sibling = parent.children[i-1]
+        child = self._child(parent, i)
+        sibling = self._child(parent, i - 1)
         
         # Bước 1: Thông báo kế hoạch (Như cũ)
-        self.capture_state(f"👈 <b>Mượn Trái:</b> Cha <b>{parent.keys[i-1].ma_sach}</b> xuống, Anh <b>{sibling.keys[-1].ma_sach}</b> lên.", [parent, child, sibling])
+        if self.trace: self.capture_state(f"👈 <b>Mượn Trái:</b> Cha <b>{parent.keys[i-1].ma_sach}</b> xuống, Anh <b>{sibling.keys[-1].ma_sach}</b> lên.", [parent, child, sibling])
         
         # --- Logic thay đổi dữ liệu ---
-        child.keys.insert(0, parent.keys[i-1])
+        child.insert_key(0, parent.keys[i-1])
         if not child.leaf: child.children.insert(0, sibling.children.pop())
-        parent.keys[i-1] = sibling.keys.pop()
+        parent.set_key(i-1, sibling.pop_key())
+        child.recount(self._resolve)
+        sibling.recount(self._resolve)
         
-        self.affected_nodes.update([child, sibling, parent])
+        if self.trace: self._touch(child, sibling, parent)
 
         # --- [MỚI] Bước 2: Show kết quả ngay sau khi xoay (Giữ highlight) ---
-        self.capture_state(f"✨ <b>Đã xoay:</b> Cấu trúc cân bằng lại sau khi mượn.", [parent, child, sibling])
+        if self.trace: self.capture_state(f"✨ <b>Đã xoay:</b> Cấu trúc cân bằng lại sau khi mượn.", [parent, child, sibling])
 
+    @metrics.timed('btree_borrow_seconds{side="next"}', gate='instrument')
     def _borrow_from_next(self, parent, i):
-        child = parent.children[i]
-        sibling = parent.children[i+1]
+        child = self._child(parent, i)
+        sibling = self._child(parent, i + 1)
         
         # Bước 1: Thông báo kế hoạch (Như cũ)
-        self.capture_state(f"👉 <b>Mượn Phải:</b> Cha <b>{parent.keys[i].ma_sach}</b> xuống, Em <b>{sibling.keys[0].ma_sach}</b> lên.", [parent, child, sibling])
+        if self.trace: self.capture_state(f"👉 <b>Mượn Phải:</b> Cha <b>{parent.keys[i].ma_sach}</b> xuống, Em <b>{sibling.keys[0].ma_sach}</b> lên.", [parent, child, sibling])
         
         # --- Logic thay đổi dữ liệu ---
-        child.keys.append(parent.keys[i])
+        child.insert_key(len(child.keys), parent.keys[i])
         if not child.leaf: child.children.append(sibling.children.pop(0))
-        parent.keys[i] = sibling.keys.pop(0)
+        parent.set_key(i, sibling.pop_key(0))
+        child.recount(self._resolve)
+        sibling.recount(self._resolve)
         
-        self.affected_nodes.update([child, sibling, parent])
+        if self.trace: self._touch(child, sibling, parent)
 
         # --- [MỚI] Bước 2: Show kết quả ngay sau khi xoay (Giữ highlight) ---
-        self.capture_state(f"✨ <b>Đã xoay:</b> Cấu trúc cân bằng lại sau khi mượn.", [parent, child, sibling])
+        if self.trace: self.capture_state(f"✨ <b>Đã xoay:</b> Cấu trúc cân bằng lại sau khi mượn.", [parent, child, sibling])
 
+    @metrics.timed('btree_merge_seconds', gate='instrument')
     def _merge(self, parent, i):
-        child = parent.children[i]
-        sibling = parent.children[i+1]
+        child = self._child(parent, i)
+        sibling = self._child(parent, i + 1)
         
         # --- BƯỚC 1: Kế hoạch (Bạn đã có) ---
-        self.capture_state(f"🔗 <b>Gộp Node:</b> Không mượn được. Gộp 2 con và khóa cha <b>{parent.keys[i].ma_sach}</b>.", [parent, child, sibling])
+        if self.trace: self.capture_state(f"🔗 <b>Gộp Node:</b> Không mượn được. Gộp 2 con và khóa cha <b>{parent.keys[i].ma_sach}</b>.", [parent, child, sibling])
         
         # --- LOGIC THUẬT TOÁN ---
         # 1. Đưa khóa cha xuống
-        child.keys.append(parent.keys[i])
         # 2. Gộp khóa của anh em
-        child.keys.extend(sibling.keys)
+        child.set_keys(child.keys + [parent.keys[i]] + sibling.keys)
         # 3. Gộp con của anh em (nếu có)
         if not child.leaf: child.children.extend(sibling.children)
         
         # 4. Xóa khóa cha và node anh em thừa
-        parent.keys.pop(i)
+        parent.pop_key(i)
         parent.children.pop(i+1)
+        child.recount(self._resolve)
+        self._free_node(sibling)
+        self.node_count -= 1
         
         # Cập nhật danh sách node bị ảnh hưởng (Lúc này sibling đã bị xóa, chỉ còn parent và child)
-        self.affected_nodes.update([child, parent])
+        if self.trace: self._touch(child, parent)
 
         # --- [QUAN TRỌNG] BƯỚC 2: Show kết quả gộp (Bước đệm) ---
         # Đây là bước giúp mắt người xem "nghỉ" và xác nhận khóa cha đã chui xuống dưới an toàn
-        self.capture_state(
-            f"✅ <b>Gộp xong:</b> Node con mới chứa {len(child.keys)} khóa.", 
-            highlight_nodes=[child] # Chỉ highlight node con mới gộp
-        )
+        if self.trace:
+            self.capture_state(
+                f"✅ <b>Gộp xong:</b> Node con mới chứa {len(child.keys)} khóa.", 
+                highlight_nodes=[child] # Chỉ highlight node con mới gộp
+            )
 
     def _get_predecessor(self, node, i):
-        cur = node.children[i]
-        while not cur.leaf: cur = cur.children[-1]
+        cur = self._child(node, i)
+        while not cur.leaf: cur = self._child(cur, -1)
         return cur.keys[-1]
 
     def _get_successor(self, node, i):
-        cur = node.children[i+1]
-        while not cur.leaf: cur = cur.children[0]
+        cur = self._child(node, i + 1)
+        while not cur.leaf: cur = self._child(cur, 0)
         return cur.keys[0]
 
+    # --- ORDER STATISTICS (subtree sizes) ---
+    def _count_below(self, ma_sach, inclusive=False):
+        """Number of keys < ma_sach (<= if inclusive), in one root-to-leaf descent."""
+        find, key = bisect_right if inclusive else bisect_left, self._key(ma_sach)
+        node, count = self.root, 0
+        while True:
+            i = find(node.ids, key)
+            count += i
+            if node.leaf: return count
+            count += sum(self._child(node, j).size for j in range(i))
+            node = self._child(node, i)
+
+    def rank(self, ma_sach):
+        """0-based position of ma_sach in key order (= number of smaller keys). O(log N)."""
+        return self._count_below(str(ma_sach))
+
+    def count_range(self, min_val, max_val):
+        """Number of keys in [min_val, max_val] without materializing them. O(log N)."""
+        min_val, max_val = str(min_val), str(max_val)
+        if self._key(min_val) > self._key(max_val): return 0
+        return self._count_below(max_val, inclusive=True) - self._count_below(min_val)
+
+    def select(self, k):
+        """The k-th book in key order (0-based), or None if out of range. O(log N)."""
+        if not 0 <= k < self.size: return None
+        node = self.root
+        while not node.leaf:
+            for i in range(len(node.children)):
+                child = self._child(node, i)
+                if k < child.size:
+                    node = child
+                    break
+                k -= child.size
+                if k == 0: return node.keys[i]
+                k -= 1
+        return node.keys[k]
+
+    # --- SECONDARY INDEXES ---
+    def create_index(self, field, m=64):
+        """Attaches a secondary index on a Book field; it is built from the tree on first lookup."""
+        idx = SecondaryIndex(field, m=m, source=self)
+        self.indexes[field] = idx
+        return idx
+
+    # --- BULK LOADING ---
+    @classmethod
+    def bulk_load(cls, sorted_books, m=5, fill_factor=1.0, pool=None, progress=None, workers=1, codec=None, instrument=True):
+        """
+        Builds a tree bottom-up from books sorted by ma_sach (no duplicates) in O(N).
+        The leaves are packed straight from the iterable (any sorted stream, never materialized);
+        the upper levels are cut into near-equal nodes of ~fill_factor * max_keys keys, with one
+        separator key between neighbours; the separators become the keys of the next level.
+        fill_factor is clamped so every non-root node still holds at least min_keys keys.
+        workers > 1 encodes the leaf pages of a paged tree in a process pool (see _pack_leaves_sharded).
+        With a key codec the books are (re)sorted by encoded key first, so the input is materialized and
+        an id the codec cannot hold raises ValueError. A paged tree checks every book with
+        PageFile.check_book before its page is written (ValueError on a field too long for a page).
+        """
+        tree = cls(m=m, pool=pool, codec=codec, instrument=instrument)
+        if codec is not None: sorted_books = sorted(sorted_books, key=lambda b: codec.check(b.ma_sach))
+        if pool is not None:
+            check = pool.file.check_book
+            if isinstance(sorted_books, list):
+                for b in sorted_books: check(b)
+            else: sorted_books = (b for b in sorted_books if check(b) is None)     # Luồng: kiểm tra khi đọc tới
+        cap = max(2 * tree.min_keys, 1, min(tree.max_keys, round(fill_factor * tree.max_keys)))
+        if workers > 1 and pool is not None and isinstance(sorted_books, list) and len(sorted_books) >= 2 * (cap + 1):
+            nodes, keys, sizes = tree._pack_leaves_sharded(sorted_books, cap, workers, progress)
+        else: nodes, keys, sizes = tree._pack_leaves(sorted_books, cap, progress)
+        if not nodes: return tree
+        tree.node_count = len(nodes)
+        while len(nodes) > 1:
+            nodes, keys, sizes = tree._pack_level(keys, nodes, cap, sizes)
+            tree.node_count += len(nodes)
+        tree._free_node(tree.root)
+        tree.root = tree._get(nodes[0])
+        return tree
+
+    def _pack_leaves(self, books, cap, progress=None):
+        """
+        Leaf level from a sorted stream: full leaves of cap keys, each followed by a separator.
+        The last full leaf is held back so a short tail can be re-split evenly with it
+        (cap >= 2 * min_keys keeps both halves legal). Returns (leaf refs, separators, sizes).
+        """
+        nodes, seps, sizes = [], [], []
+        def emit(keys):
+            leaf = self._new_node(leaf=True)
+            leaf.set_keys(keys)
+            leaf.size = len(keys)
+            nodes.append(self._ref(leaf))
+            sizes.append(leaf.size)
+        held, buf, count = None, [], 0
+        for book in books:
+            buf.append(book)
+            if len(buf) > cap:
+                if held is not None: emit(held)
+                held = buf[:cap]
+                seps.append(buf[cap])
+                buf = []
+                count += cap + 1
+                if progress and count % PROGRESS_EVERY < cap + 1: progress('build', count)
+        if held is None:
+            if buf: emit(buf)
+        elif len(buf) >= self.min_keys:
+            emit(held)
+            emit(buf)
+        else:
+            tail = held + [seps.pop()] + buf
+            half = (len(tail) - 1) // 2
+            emit(tail[:half])
+            seps.append(tail[half])
+            emit(tail[half + 1:])
+        if progress: progress('build', count + len(buf))
+        return nodes, seps, sizes
+
+    def _pack_leaves_sharded(self, books, cap, workers, progress=None):
+        """
+        Leaf level of a paged tree built in parallel: the books are cut into `workers` contiguous key
+        ranges (one separator between neighbours), each range is encoded into leaf page images by
+        _encode_leaf_shard in a ProcessPoolExecutor, and the pages are copied into the file in key
+        order. Workers share the _group_sizes layout, so separators and sizes are known here without
+        decoding anything; the (few) upper levels are then packed in-process as usual.
+        """
+        count = min(workers, len(books) // (cap + 1))          # Mỗi dải >= cap khóa: các lá đều hợp lệ
+        shards = _group_sizes(len(books), len(books) // count)
+        nodes, seps, sizes = [], [], []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            jobs, start = [], 0
+            for n in shards:
+                rows = [(b.ma_sach, b.ten_sach, b.tac_gia) for b in books[start:start + n]]
+                jobs.append((start, n, executor.submit(_encode_leaf_shard, rows, cap)))
+                start += n + 1
+            for start, n, job in jobs:
+                if nodes: seps.append(books[start - 1])    # Khóa ngăn cách giữa hai dải
+                pos = start
+                for size, pid in zip(_group_sizes(n, cap), self.pool.write_pages(job.result())):
+                    if pos > start: seps.append(books[pos - 1])
+                    nodes.append(pid)
+                    sizes.append(size)
+                    pos += size + 1
+                if progress: progress('build', start + n)
+        return nodes, seps, sizes
+
+    def _pack_level(self, keys, children, cap, child_sizes=None):
+        """
+        Groups one level: returns (node refs, separators, subtree sizes). children=None means leaf level.
+        Sizes are carried up from the level below so no child page has to be read back.
+        """
+        nodes, seps, sizes = [], [], []
+        pos = child_pos = 0
+        groups = _group_sizes(len(keys), cap)
+        for g, size in enumerate(groups):
+            node = self._new_node(leaf=children is None)
+            node.set_keys(keys[pos:pos + size])
+            pos += size
+            node.size = size
+            if children is not None:
+                node.children = children[child_pos:child_pos + size + 1]
+                node.size += sum(child_sizes[child_pos:child_pos + size + 1])
+                child_pos += size + 1
+            nodes.append(self._ref(node))
+            sizes.append(node.size)
+            if g < len(groups) - 1:
+                seps.append(keys[pos])
+                pos += 1
+        return nodes, seps, sizes
+
     # --- UTILITIES ---
-    def get_all_books(self): return self._inorder(self.root)
-    def _inorder(self, node):
-        res = []
-        if not node: return res
-        for i in range(len(node.keys)):
-            if not node.leaf: res.extend(self._inorder(node.children[i]))
-            res.append(node.keys[i])
-        if not node.leaf: res.extend(self._inorder(node.children[-1]))
-        return res
-    def get_tree_structure(self): return self.root.to_dict()
+    def get_all_books(self): return list(self.iter_books())
+    def iter_books(self, after=None):
+        """Lazy in-order generator, optionally starting strictly after ma_sach `after`."""
+        return self.iter_range(after=after)
+    def get_tree_structure(self): return self.root.to_dict(self._resolve)
+
+    def node_at(self, path):
+        """Node reached from the root by a list of child indexes. Raises IndexError on a bad path."""
+        node = self.root
+        for i in path:
+            if node.leaf or not 0 <= i < len(node.children): raise IndexError(f"Không có nhánh {i} tại {[k.ma_sach for k in node.keys]}")
+            node = self._child(node, i)
+        return node
+
+    def get_tree_view(self, depth=None, path=()):
+        """
+        Level-of-detail view of the subtree at `path`: `depth` levels of full nodes (depth=None: all),
+        below which each child is a stub {'stub', 'path', 'size', 'min_key', 'max_key'} to expand on demand.
+        """
+        def stub(node, path):
+            first = last = node
+            while not first.leaf: first = self._child(first, 0)
+            while not last.leaf: last = self._child(last, -1)
+            return {'id': node.id, 'stub': True, 'leaf': node.leaf, 'path': path, 'size': node.size, 'keys': [], 'children': [],
+                    'min_key': first.keys[0].ma_sach if first.keys else None, 'max_key': last.keys[-1].ma_sach if last.keys else None}
+        def view(node, path, level):
+            expand = depth is None or level < depth
+            children = [self._child(node, i) for i in range(len(node.children))]
+            return {'id': node.id, 'keys': [k.to_dict() for k in node.keys], 'leaf': node.leaf, 'path': path, 'size': node.size,
+                    'children': [view(c, path + [i], level + 1) if expand else stub(c, path + [i]) for i, c in enumerate(children)]}
+        return view(self.node_at(path), list(path), 1)
     def get_affected_nodes_data(self): return [[k.ma_sach for k in n.keys] for n in self.affected_nodes]
 
+    def height(self):
+        node, h = self.root, 1
+        while not node.leaf: node, h = self._child(node, 0), h + 1
+        return h
+
+    def health(self, buckets=10):
+        """
+        Full-walk health report: per level the node and key counts, mean fill (keys / max_keys),
+        nodes below min_keys (never expected outside the root) and an occupancy histogram of `buckets` bins.
+        """
+        levels, level = [], [self.root]
+        resolve = self._resolve or (lambda child: child)     # Cây phân trang: đọc trang, không ghim / đánh dấu bẩn
+        while level:
+            fills = [len(n.keys) / self.max_keys for n in level]
+            histogram = [0] * buckets
+            for f in fills: histogram[min(int(f * buckets), buckets - 1)] += 1
+            levels.append({'level': len(levels), 'nodes': len(level), 'keys': sum(len(n.keys) for n in level),
+                           'fill': round(sum(fills) / len(fills), 4),
+                           'underfull': sum(len(n.keys) < self.min_keys for n in level) if levels else 0,  # Gốc được phép thiếu
+                           'histogram': histogram})
+            level = [resolve(c) for n in level if not n.leaf for c in n.children]
+        return {'height': len(levels), 'node_count': self.node_count, 'books': self.size, 'm': self.m,
+                'max_keys': self.max_keys, 'min_keys': self.min_keys,
+                'fill_factor': round(self.size / (self.node_count * self.max_keys), 4), 'levels': levels,
+                'buffer_pool': self.pool.stats() if self.pool is not None else None}
+
+def _group_sizes(n, cap):
+    """Splits n sorted keys into near-equal groups of <= cap keys with one separator between groups."""
+    groups = -(-(n + 1) // (cap + 1))
+    per, extra = divmod(n - groups + 1, groups)
+    return [per + (1 if g < extra else 0) for g in range(groups)]
+
+def _encode_leaf_shard(rows, cap):
+    """Process-pool worker: (ma_sach, ten_sach, tac_gia) rows of one key range -> leaf page images."""
+    pages, pos = [], 0
+    for size in _group_sizes(len(rows), cap):
+        pages.append(PageFile.encode_page(True, size, rows[pos:pos + size]))
+        pos += size + 1
+    return pages
+
+def normalize_text(text):
+    """Accent-folded, lower-cased, space-collapsed form: 'Nguyễn Văn Đức' -> 'nguyen van duc'."""
+    text = unicodedata.normalize('NFD', str(text or '')).replace('đ', 'd').replace('Đ', 'D')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+class IndexEntry:
+    """
+    Key of a secondary index: '<normalized value>\\x1f<ma_sach>'.
+    Stored under 'ma_sach' because that is the attribute BTree orders by; 'book' points at the row.
+    """
+    __slots__ = ('ma_sach', 'book')
+
+    def __init__(self, key, book):
+        self.ma_sach = key
+        self.book = book
+
+
+class SecondaryIndex:
+    """
+    Secondary B-Tree on one Book field, built on the BTree class itself.
+    Appending ma_sach to the normalized value keeps keys unique, so exact and prefix
+    lookups are both cursor range scans: O(log N + k).
+    """
+    SEP = '\x1f'
+
+    def __init__(self, field, m=64, source=None):
+        self.field = field
+        self.m = m
+        self.source = source    # Cây chính: chỉ mục được dựng lười ở lần tra cứu đầu tiên
+        self.tree = BTree(m=m, instrument=False) if source is None else None
+
+    def _key(self, book):
+        return normalize_text(getattr(book, self.field)) + self.SEP + book.ma_sach
+
+    def build(self, books):
+        entries = sorted((IndexEntry(self._key(b), b) for b in books), key=lambda e: e.ma_sach)
+        self.tree = BTree.bulk_load(entries, m=self.m, instrument=False)
+
+    def ensure_built(self):
+        if self.tree is None: self.build(self.source.iter_books())
+        return self.tree
+
+    def add(self, book):
+        if self.tree is not None: self.tree.insert(IndexEntry(self._key(book), book), trace=False)
+    def remove(self, book):
+        if self.tree is not None: self.tree.delete(self._key(book), trace=False)
+
+    def lookup(self, query, prefix=False, limit=None):
+        """Books whose normalized field equals (or starts with) the normalized query."""
+        self.ensure_built()
+        q = normalize_text(query)
+        lo, hi = (q, q + '\uffff') if prefix else (q + self.SEP, q + self.SEP + '\uffff')
+        return [e.book for e in itertools.islice(self.tree.iter_range(lo, hi), limit)]
+
+
+class IdAllocator:
+    """
+    Free generated ids (BK-0001..BK-<BOOK_ID_MAX>), kept in step with the tree as its id_allocator.
+    `free` holds the unused numbers in any order and `pos[n]` is n's slot in it (-1 = taken), so taking,
+    freeing and a uniform random pick are O(1) swaps; `top` caches the highest taken number.
+    Built lazily with one range scan over the BK- keys, like SecondaryIndex.
+    """
+    PREFIX = 'BK-'
+
+    def __init__(self, source, limit=BOOK_ID_MAX):
+        self.source = source
+        self.limit = limit
+        self.width = len(str(limit))
+        self.free = None
+
+    def number(self, ma_sach):
+        """n for an id of the generated form 'BK-' + n zero-padded to `width` digits, else None."""
+        digits = ma_sach[len(self.PREFIX):]
+        if not ma_sach.startswith(self.PREFIX) or len(digits) != self.width or not digits.isdigit(): return None
+        n = int(digits)
+        return n if 1 <= n <= self.limit else None
+
+    def format(self, n): return f"{self.PREFIX}{n:0{self.width}d}"
+
+    def ensure_built(self):
+        if self.free is None:
+            taken = [n for b in self.source.iter_range(self.format(1), self.format(self.limit)) if (n := self.number(b.ma_sach))]
+            self.pos = [0] * (self.limit + 1)
+            for n in taken: self.pos[n] = -1
+            self.pos[0] = -1
+            self.free = [n for n in range(1, self.limit + 1) if self.pos[n] == 0]
+            for i, n in enumerate(self.free): self.pos[n] = i
+            self.top = max(taken, default=0)
+        return self
+
+    def _take(self, n):
+        i = self.pos[n]
+        last = self.free.pop()
+        if last != n:
+            self.free[i] = last
+            self.pos[last] = i
+        self.pos[n] = -1
+        if n > self.top: self.top = n
+
+    def add(self, book):
+        if self.free is not None and (n := self.number(book.ma_sach)) and self.pos[n] >= 0: self._take(n)
+    def remove(self, book):
+        if self.free is None or not (n := self.number(book.ma_sach)) or self.pos[n] >= 0: return
+        self.pos[n] = len(self.free)
+        self.free.append(n)
+        while self.top and self.pos[self.top] >= 0: self.top -= 1   # Chỉ khi xóa đúng mã lớn nhất: lùi qua các số trống liền dưới
+
+    def random_id(self, rnd=random):
+        """A uniformly random free id. Raises ValueError when every id is taken."""
+        self.ensure_built()
+        if not self.free: raise ValueError(f"Hết mã trống ({self.format(1)}..{self.format(self.limit)})")
+        return self.format(self.free[rnd.randrange(len(self.free))])
+
+    def next_id(self):
+        """The id after the highest taken one; once that is the last id, any free id. Raises ValueError when full."""
+        self.ensure_built()
+        if self.top < self.limit: return self.format(self.top + 1)
+        return self.random_id()
+
+
+# --- PAGED STORAGE ---
+class PageFile:
+    """
+    B-Tree nodes as fixed-size pages of a memory-mapped file.
+    Two 4 KB meta slots come first; a checkpoint writes the slot after the current one
+    (sequence number + CRC), so the newest valid slot always names a complete tree.
+    Data page ids start at 1 (0 = none); each page holds one node:
+    leaf flag, key count, subtree size, keys as 3 length-prefixed UTF-8 fields, child page ids.
+    Version 2 writes a None field as the length byte NULL_FIELD; version 1 files (None stored as '')
+    are still opened and keep their encoding until rebuilt.
+    """
+    MAGIC = b'BTPG'
+    VERSION = 2
+    META_SLOT = 4096
+    META = struct.Struct('<4sHHIQIIII')     # magic, version, m, page_size, seq, root, pages, node_count, free count
+    NODE = struct.Struct('<BHI')            # leaf, key count, subtree size
+    MAX_FIELD_BYTES = 254
+    NULL_FIELD = 255                        # Byte độ dài của trường None (từ version 2)
+
+    @classmethod
+    def page_size_for(cls, m):
+        """Worst case node (m-1 keys with maximal fields, m children), rounded up to 4 KB."""
+        need = cls.NODE.size + (m - 1) * 3 * (1 + cls.MAX_FIELD_BYTES) + m * 4
+        return -(-need // 4096) * 4096
+
+    def __init__(self, path, m=None):
+        """Opens an existing page file (m is read from it) or creates a new one for degree m."""
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._f = open(path, 'r+b' if exists else 'w+b')
+        meta = self._read_meta() if exists else None
+        if meta is None:
+            if exists or m is None:
+                self._f.close()
+                raise ValueError(f"{path}: không có meta hợp lệ")
+            self.m, self.page_size, self.format = m, self.page_size_for(m), self.VERSION
+            self.seq = self.root = self.pages = self.node_count = 0
+            self.free = []
+            self._f.truncate(2 * self.META_SLOT + 16 * self.page_size)
+        else:
+            self.m, self.page_size, self.seq, self.root, self.pages, self.node_count, self.free, self.format = meta
+        self.null_field = self.NULL_FIELD if self.format >= 2 else None
+        self._mm = mmap.mmap(self._f.fileno(), 0)
+
+    def _read_meta(self):
+        best = None
+        for slot in (0, 1):
+            self._f.seek(slot * self.META_SLOT)
+            raw = self._f.read(self.META_SLOT)
+            if len(raw) < self.META.size: continue
+            magic, version, m, page_size, seq, root, pages, node_count, nfree = self.META.unpack_from(raw)
+            end = self.META.size + 4 * nfree
+            if magic != self.MAGIC or version not in (1, self.VERSION) or end + 4 > len(raw): continue
+            if struct.unpack_from('<I', raw, end)[0] != zlib.crc32(raw[:end]): continue
+            if best is None or seq > best[2]:
+                best = (m, page_size, seq, root, pages, node_count, list(struct.unpack_from(f'<{nfree}I', raw, self.META.size)), version)
+        return best
+
+    def _offset(self, pid): return 2 * self.META_SLOT + (pid - 1) * self.page_size
+
+    def alloc(self):
+        """A free page id (reused or appended; the file grows geometrically)."""
+        if self.free: return self.free.pop()
+        self.pages += 1
+        end = self._offset(self.pages + 1)
+        if end > len(self._mm):
+            grown = max(end, 2 * len(self._mm))
+            self._mm.close()
+            self._f.truncate(grown)
+            self._mm = mmap.mmap(self._f.fileno(), 0)
+        return self.pages
+
+    @classmethod
+    def field_limit(cls, null_field):
+        """Longest field in bytes: 254 once 255 marks None (version 2), the full 255 in version 1."""
+        return cls.MAX_FIELD_BYTES if null_field is not None else 255
+
+    def check_book(self, book):
+        limit = self.field_limit(self.null_field)
+        for value in (book.ma_sach, book.ten_sach, book.tac_gia):
+            if len(self._encode(value)) > limit:
+                raise ValueError(f"Trường quá dài (tối đa {limit} byte UTF-8): {str(value)[:40]}...")
+
+    @staticmethod
+    def _encode(value): return ('' if value is None else str(value)).encode('utf-8')
+
+    @classmethod
+    def encode_page(cls, leaf, size, rows, children=(), null_field=NULL_FIELD):
+        """Page image of a node; rows are the (ma_sach, ten_sach, tac_gia) of its keys."""
+        parts, limit = [cls.NODE.pack(leaf, len(rows), size)], cls.field_limit(null_field)
+        for row in rows:
+            for value in row:
+                if value is None and null_field is not None:
+                    parts.append(bytes((null_field,)))
+                    continue
+                data = cls._encode(value)
+                if len(data) > limit: raise ValueError(f"Trường quá dài (tối đa {limit} byte UTF-8): {str(value)[:40]}...")
+                parts += (bytes((len(data),)), data)
+        if not leaf: parts.append(struct.pack(f'<{len(children)}I', *children))
+        return b''.join(parts)
+
+    def write_node(self, node):
+        rows = [(b.ma_sach, b.ten_sach, b.tac_gia) for b in node.keys]
+        self.write_page(node.id, self.encode_page(node.leaf, node.size, rows, node.children, self.null_field))
+
+    def write_page(self, pid, page):
+        off = self._offset(pid)
+        self._mm[off:off + len(page)] = page
+
+    def read_node(self, pid):
+        mm, pos = self._mm, self._offset(pid)
+        leaf, nkeys, size = self.NODE.unpack_from(mm, pos)
+        pos += self.NODE.size
+        keys = []
+        for _ in range(nkeys):
+            fields = []
+            for _ in range(3):
+                n = mm[pos]
+                if n == self.null_field:
+                    fields.append(None)
+                    pos += 1
+                    continue
+                fields.append(mm[pos + 1:pos + 1 + n].decode('utf-8'))
+                pos += 1 + n
+            keys.append(Book(*fields))
+        node = BTreeNode(leaf=bool(leaf))
+        node.id, node.size = pid, size
+        node.set_keys(keys)
+        if not leaf: node.children = list(struct.unpack_from(f'<{nkeys + 1}I', mm, pos))
+        return node
+
+    def commit(self, root, node_count, free):
+        """Flushes data pages, then writes and flushes the next meta slot (the commit point)."""
+        self.sync()
+        free = free[:(self.META_SLOT - self.META.size - 4) // 4]    # Phần vượt quá chỉ bị rò rỉ tới lần dựng lại file
+        self.seq += 1
+        body = self.META.pack(self.MAGIC, self.format, self.m, self.page_size, self.seq, root, self.pages, node_count, len(free))
+        body += struct.pack(f'<{len(free)}I', *free)
+        body += struct.pack('<I', zlib.crc32(body))
+        off = (self.seq % 2) * self.META_SLOT
+        self._mm[off:off + len(body)] = body
+        self.sync()
+        self.root, self.node_count, self.free = root, node_count, list(free)
+
+    def sync(self):
+        self._mm.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._mm.close()
+        self._f.close()
+
+
+class BufferPool:
+    """
+    LRU cache of decoded nodes over a PageFile ('hits' / 'faults' count cache hits and page reads).
+    Pages of the last checkpoint are never overwritten: a node that changed since then moves to a
+    new page at the next checkpoint (its parent changed too, since every mutation updates subtree
+    sizes up to the root), so a crash always leaves the previous tree intact and the WAL redoes the rest.
+    Nodes created since the checkpoint ('fresh') may be written back early when evicted,
+    which keeps memory bounded while bulk loading.
+    """
+    def __init__(self, page_file, capacity=BUFFER_POOL_PAGES):
+        self.file = page_file
+        self.capacity = max(8, capacity)
+        self.hits = self.faults = self.writes = 0
+        self._cache = OrderedDict()     # page id -> BTreeNode, LRU first
+        self._dirty = set()
+        self._fresh = set()             # allocated since the last checkpoint
+        self._retired = []              # pages of the last checkpoint freed since then
+        self._pinned = None             # set() while a mutating operation runs
+        self._lock = threading.Lock()   # readers share the pool under the tree's read lock
+
+    def get(self, pid):
+        """Node of a page. Inside an operation the page is pinned and will be rewritten."""
+        with self._lock:
+            node = self._cache.get(pid)
+            if node is None:
+                self.faults += 1
+                self._evict(1)
+                node = self._cache[pid] = self.file.read_node(pid)
+            else:
+                self.hits += 1
+                self._cache.move_to_end(pid)
+            if self._pinned is not None:
+                self._pinned.add(pid)
+                self._dirty.add(pid)
+        return node
+
+    def read(self, pid):
+        """Like get() but never pins or dirties the page (recount, to_dict)."""
+        with self._lock:
+            node = self._cache.get(pid)
+            if node is None:
+                self.faults += 1
+                self._evict(1)
+                node = self._cache[pid] = self.file.read_node(pid)
+            else:
+                self.hits += 1
+            return node
+
+    def new_node(self, leaf):
+        with self._lock:
+            self._evict(1)
+            node = BTreeNode(leaf=leaf)
+            node.id = self.file.alloc()
+            self._cache[node.id] = node
+            self._dirty.add(node.id)
+            self._fresh.add(node.id)
+            if self._pinned is not None: self._pinned.add(node.id)
+        return node
+
+    def write_pages(self, pages):
+        """Stores ready-made page images (parallel bulk load) straight into new pages; returns their ids."""
+        with self._lock:
+            pids = [self.file.alloc() for _ in pages]
+            for pid, page in zip(pids, pages): self.file.write_page(pid, page)
+            self._fresh.update(pids)
+            self.writes += len(pids)
+        return pids
+
+    def free(self, node):
+        with self._lock:
+            self._cache.pop(node.id, None)
+            self._dirty.discard(node.id)
+            if self._pinned is not None: self._pinned.discard(node.id)
+            if node.id in self._fresh:
+                self._fresh.discard(node.id)
+                self.file.free.append(node.id)
+            else: self._retired.append(node.id)
+
+    @contextmanager
+    def operation(self, root):
+        """Pins (and marks dirty) every page touched until the operation ends; the root is held by the tree."""
+        with self._lock:
+            self._pinned = {root.id}
+            self._cache[root.id] = root
+            self._dirty.add(root.id)
+        try: yield
+        finally:
+            with self._lock:
+                self._pinned = None
+                self._evict()
+
+    def needs_checkpoint(self): return len(self._dirty) > self.capacity // 2
+
+    def _evict(self, room=0):
+        excess = len(self._cache) + room - self.capacity
+        if excess <= 0: return
+        victims = []
+        for pid, node in self._cache.items():
+            if len(victims) >= excess: break
+            if self._pinned is not None and pid in self._pinned: continue
+            if pid in self._dirty:
+                # Trang của checkpoint trước chỉ được ghi khi checkpoint (sang trang mới);
+                # node mới thì ghi sớm được, trừ khi con của nó còn chờ đổi trang
+                if pid not in self._fresh or any(c in self._dirty and c not in self._fresh for c in node.children): continue
+                self.file.write_node(node)
+                self.writes += 1
+                self._dirty.discard(pid)
+            victims.append(pid)
+        for pid in victims: del self._cache[pid]
+
+    @metrics.timed('btree_persist_seconds{kind="checkpoint"}')
+    def checkpoint(self, root, node_count):
+        """Writes every dirty node (moving those from the last checkpoint) and commits `root`."""
+        with self._lock:
+            moved = {pid: self.file.alloc() for pid in self._dirty if pid not in self._fresh}
+            for pid in list(self._dirty):
+                node = self._cache.pop(pid)
+                if not node.leaf: node.children = [moved.get(c, c) for c in node.children]
+                node.id = moved.get(pid, pid)
+                self._cache[node.id] = node
+                self.file.write_node(node)
+                self.writes += 1
+            self.file.commit(root.id, node_count, self.file.free + self._retired + list(moved))
+            self._dirty.clear()
+            self._fresh.clear()
+            self._retired = []
+            self._evict()
+
+    def stats(self):
+        return {'capacity': self.capacity, 'cached': len(self._cache), 'dirty': len(self._dirty),
+                'hits': self.hits, 'faults': self.faults, 'writes': self.writes, 'pages': self.file.pages}
+
+
+# --- CONCURRENCY ---
+class RWLock:
+    """
+    Reader-writer lock for the global tree: any number of readers, or one writer.
+    Writer-preferring (new readers wait while a writer is queued) so a steady read load cannot starve mutations.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting: self._cond.wait()
+            self._readers += 1
+        try: yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers: self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers: self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try: yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+tree_lock = RWLock()   # Bảo vệ biến toàn cục `btree` (kể cả khi bị thay bằng cây mới)
+
+def reads(fn):
+    """Route decorator: runs the handler under the shared (read) lock."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with tree_lock.read(): return fn(*args, **kwargs)
+    return wrapper
+
+def writes(fn):
+    """Route decorator: runs the handler under the exclusive (write) lock."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with tree_lock.write(): return fn(*args, **kwargs)
+    return wrapper
+
+
 # --- PERSISTENCE & ROUTES ---
-btree = BTree(m=5)
+def _attach_indexes(tree):
+    for field in INDEXED_FIELDS: tree.create_index(field)
+    tree.id_allocator = IdAllocator(tree)
+    return tree
+
+btree = _attach_indexes(BTree(m=5, codec=_key_codec()))
+
+# --- BINARY SNAPSHOT ---
+SNAPSHOT_MAGIC = b'BKSN'
+SNAPSHOT_VERSION = 2                        # v2: độ dài _SNAP_NULL đánh dấu trường None (v1 không có None)
+_SNAP_HEADER = struct.Struct('<4sHHQBQ')    # magic, version, m, book count, flags, text bytes
+_SNAP_SORTED = 1                            # books are in strictly increasing ma_sach order
+_SNAP_SPLIT = 2                             # no field contains NUL and none is None: the text block can be split on it
+_SNAP_NULL = 0xFFFFFFFF                     # length table entry of a None field (its text is empty)
+
+@contextmanager
+def _gc_paused():
+    """Bulk decoding creates millions of acyclic objects; pausing the cyclic GC avoids rescanning them."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try: yield
+    finally:
+        if enabled: gc.enable()
+
+@metrics.timed('btree_persist_seconds{kind="snapshot"}')
+def write_snapshot(path, books, m):
+    """
+    Binary snapshot: header, the length (uint32, in characters; _SNAP_NULL for None) of each of the
+    3 fields of every book, then all fields as one NUL-separated UTF-8 block, then a CRC32 of
+    everything before it. Written to '<path>.tmp', fsynced and swapped in with os.replace.
+    """
+    fields = [None if v is None else str(v) for b in books for v in (b.ma_sach, b.ten_sach, b.tac_gia)]
+    nulls = fields.count(None)
+    if nulls:
+        lengths = array('I', [_SNAP_NULL if v is None else len(v) for v in fields])
+        fields = ['' if v is None else v for v in fields]
+    else: lengths = array('I', map(len, fields))
+    if sys.byteorder == 'big': lengths.byteswap()
+    text = '\x00'.join(fields)
+    split = not nulls and text.count('\x00') == max(len(fields) - 1, 0)
+    flags = (_SNAP_SORTED if _is_sorted_unique(books) else 0) | (_SNAP_SPLIT if split else 0)
+    data = text.encode('utf-8')
+    header = _SNAP_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, m, len(books), flags, len(data))
+    crc = zlib.crc32(data, zlib.crc32(lengths, zlib.crc32(header)))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        for part in (header, lengths, data, struct.pack('<I', crc)): f.write(part)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def read_snapshot(path):
+    """
+    Loads a binary snapshot: returns (books, m, sorted). The UTF-8 block is decoded once from a
+    memoryview slice and split (or sliced by the length table); no per-record parsing.
+    Raises ValueError on a foreign, newer or corrupted file.
+    """
+    with open(path, 'rb') as f: raw = f.read()
+    mv = memoryview(raw)
+    if len(raw) < _SNAP_HEADER.size + 4: raise ValueError(f"{path}: snapshot cụt")
+    magic, version, m, count, flags, text_bytes = _SNAP_HEADER.unpack_from(mv)
+    if magic != SNAPSHOT_MAGIC or version > SNAPSHOT_VERSION: raise ValueError(f"{path}: không phải snapshot v{SNAPSHOT_VERSION}")
+    text_start = _SNAP_HEADER.size + 12 * count
+    end = text_start + text_bytes
+    if end + 4 != len(raw) or struct.unpack_from('<I', mv, end)[0] != zlib.crc32(mv[:end]):
+        raise ValueError(f"{path}: snapshot hỏng (sai độ dài/CRC)")
+    with _gc_paused():
+        text = str(mv[text_start:end], 'utf-8')
+        if not count: fields = []
+        elif flags & _SNAP_SPLIT: fields = text.split('\x00')
+        else:
+            lengths = array('I')
+            lengths.frombytes(mv[_SNAP_HEADER.size:text_start])
+            if sys.byteorder == 'big': lengths.byteswap()
+            fields, pos = [], 0
+            for n in lengths:
+                if n == _SNAP_NULL:
+                    fields.append(None)
+                    pos += 1
+                    continue
+                fields.append(text[pos:pos + n])
+                pos += n + 1
+        if len(fields) != 3 * count: raise ValueError(f"{path}: số trường không khớp header")
+        it = iter(fields)
+        books = list(map(Book, it, it, it))
+    return books, m, bool(flags & _SNAP_SORTED)
+
+# --- STREAMING IMPORT ---
+class _JsonReader:
+    """Incremental JSON tokenizer over a text stream: one value (or one block of array elements) at a time."""
+    def __init__(self, f, head='', block=1 << 18):
+        self.f, self.block, self.buf, self.pos = f, block, head, 0
+        self.decoder = json.JSONDecoder()
+
+    def peek(self):
+        """Next non-whitespace character ('' at end of input)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n': self.pos += 1
+            if self.pos < len(self.buf) or not self._fill(): return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, ch):
+        if self.peek() != ch: raise ValueError(f"JSON: cần '{ch}' tại vị trí {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next object/array/string, reading more blocks while it is incomplete."""
+        self.peek()
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buf, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if not self._fill(): raise
+
+    def elements(self):
+        """
+        The array elements buffered so far, decoded with a single json.loads up to the last '}'.
+        A cut that falls inside a string or a nested object cannot parse; then each complete element
+        is decoded once with raw_decode from the current offset (one cut by the block end waits for
+        the next call), so a failed cut never makes the block parse again per element.
+        """
+        end = self.buf.rfind('}', self.pos)
+        if end > self.pos:
+            try:
+                items = json.loads('[' + self.buf[self.pos:end + 1] + ']')
+                self.pos = end + 1
+                return items
+            except json.JSONDecodeError: pass
+        items, buf, decode, pos = [], self.buf, self.decoder.raw_decode, self.pos
+        while True:
+            try: item, end = decode(buf, pos)
+            except json.JSONDecodeError: break
+            items.append(item)
+            self.pos = pos = end
+            while pos < len(buf) and buf[pos] in ' \t\r\n': pos += 1
+            if buf[pos:pos + 1] != ',': break
+            pos += 1
+            while pos < len(buf) and buf[pos] in ' \t\r\n': pos += 1
+        return items or [self.value()]
+
+    def _fill(self):
+        """Appends one block, dropping the consumed prefix. Returns False at end of input."""
+        chunk = self.f.read(self.block)
+        if not chunk: return False
+        self.buf, self.pos = self.buf[self.pos:] + chunk, 0
+        return True
+
+def _iter_json_array(reader):
+    reader.expect('[')
+    while reader.peek() != ']':
+        yield reader.elements()
+        if reader.peek() != ']': reader.expect(',')
+    reader.pos += 1
+
+def _first_line_object(text, eof):
+    """The object on the first line of `text` when that line is exactly one complete JSON object, else None."""
+    nl = text.find('\n')
+    if nl < 0:
+        if not eof: return None
+        nl = len(text)
+    try: value, end = json.JSONDecoder().raw_decode(text[:nl])
+    except json.JSONDecodeError: return None
+    return value if isinstance(value, dict) and not text[end:nl].strip() else None
+
+def iter_catalogue(f, config=None, block=1 << 18):
+    """
+    Yields lists of book dicts from a text stream holding JSON lines, a JSON array, or the export
+    object {'config': {'m': ..}, 'data': [..]}; only about one block of text is held at a time.
+    The export 'config' is stored into the `config` dict when it is met.
+    It is JSON lines when the first line (read up to 4 blocks) is one complete object followed by
+    more lines, or is the only line and holds a record (ma_sach) rather than the export object.
+    """
+    head, eof = '', False
+    while not eof and ('\n' not in head.lstrip() and len(head) < 4 * block or not head.strip()):
+        more = f.read(block)
+        head, eof = head + more, not more
+    head = head.lstrip()
+    first = _first_line_object(head, eof) if head[:1] == '{' else None
+    while first is not None and not eof and not head.partition('\n')[2].strip():
+        more = f.read(block)
+        head, eof = head + more, not more
+    if first is not None and (head.partition('\n')[2].strip() or 'ma_sach' in first):
+        lines = itertools.chain(io.StringIO(head + f.readline()), f)     # JSON lines: ghép nốt dòng bị cắt ngang
+        while True:
+            block_lines = [line for line in itertools.islice(lines, 1000) if not line.isspace()]
+            if not block_lines: return
+            yield json.loads('[' + ','.join(block_lines) + ']')
+    reader = _JsonReader(f, head, block)
+    if reader.peek() == '[':
+        yield from _iter_json_array(reader)
+        return
+    reader.expect('{')
+    key = reader.value() if reader.peek() != '}' else None
+    while key is not None:
+        reader.expect(':')
+        if key == 'data': yield from _iter_json_array(reader)
+        elif key == 'config' and config is not None: config.update(reader.value())
+        else: reader.value()
+        if reader.peek() == '}': break
+        reader.expect(',')
+        key = reader.value()
+
+def _write_run(rows, tmpdir, runs):
+    """Spills one chunk, sorted by ma_sach with the last duplicate kept, as JSON lines of 1000-row blocks."""
+    rows = sorted({row[0]: row for row in rows}.values())
+    path = os.path.join(tmpdir, f"run{len(runs):05d}.jsonl")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(rows[i:i + 1000], ensure_ascii=False) + '\n' for i in range(0, len(rows), 1000))
+    runs.append(path)
+
+def _read_run(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f: yield from json.loads(line)
+
+def _catalogue_row(item, run):
+    """External-sort row of one imported record; ValueError unless it has ma_sach, ten_sach and tac_gia."""
+    if not isinstance(item, dict) or not all(f in item for f in ('ma_sach', 'ten_sach', 'tac_gia')):
+        raise ValueError(f"Bản ghi thiếu trường ma_sach/ten_sach/tac_gia: {json.dumps(item, ensure_ascii=False)[:100]}")
+    ma = str(item['ma_sach']).strip()
+    if not ma: raise ValueError(f"Bản ghi có ma_sach rỗng: {json.dumps(item, ensure_ascii=False)[:100]}")
+    return ma, run, item['ten_sach'], item['tac_gia']
+
+def external_sort(blocks, chunk=IMPORT_CHUNK, progress=None):
+    """
+    Sorted, de-duplicated Book stream from blocks of dict records in any order (same ma_sach: the
+    last one wins). Chunks of ~`chunk` records are sorted in memory and spilled to temporary run
+    files, then merged with heapq.merge; a single chunk never touches the disk. Rows are
+    (ma_sach, run, ten_sach, tac_gia): the run number breaks ties in input order, without a key function.
+    """
+    with tempfile.TemporaryDirectory(prefix='btree-import-') as tmpdir:
+        runs, rows, count = [], [], 0
+        for items in blocks:
+            run = len(runs)
+            rows.extend(_catalogue_row(item, run) for item in items)
+            if len(rows) >= chunk:
+                _write_run(rows, tmpdir, runs)
+                rows = []
+            if progress and (count + len(items)) // PROGRESS_EVERY != count // PROGRESS_EVERY: progress('sort', count + len(items))
+            count += len(items)
+        if progress: progress('sort', count)
+        if runs:
+            if rows: _write_run(rows, tmpdir, runs)
+            rows = None
+            stream = heapq.merge(*map(_read_run, runs))
+        else: stream = sorted({row[0]: row for row in rows}.values())
+        prev = None
+        for row in stream:
+            if prev is not None and row[0] != prev[0]: yield Book(prev[0], prev[2], prev[3])
+            prev = row
+        if prev is not None: yield Book(prev[0], prev[2], prev[3])
+
+def sorted_catalogue(f, m=None, chunk=IMPORT_CHUNK, progress=None):
+    """
+    Reads a (possibly multi-GB) catalogue stream with bounded working memory and returns (books, m):
+    the whole input has been parsed and spilled into sorted runs, `books` is the lazy merged stream
+    to hand to _new_tree. m defaults to the file's config, else 5. Raises ValueError on bad input.
+    """
+    config = {}
+    books = external_sort(iter_catalogue(f, config), chunk=chunk, progress=progress)
+    try: first = next(books, None)          # Đọc hết input trước đã: config có thể nằm sau 'data'
+    except (KeyError, TypeError, AttributeError) as e: raise ValueError(f"Bản ghi thiếu trường/không hợp lệ: {e!r}")
+    try: m = int(m or config.get('m', 5))
+    except (TypeError, ValueError): raise ValueError(f"m không hợp lệ: {m or config.get('m')!r}")
+    if m < 3: raise ValueError('m >= 3')
+    return (itertools.chain([first], books) if first is not None else ()), m
+
+
+class WriteAheadLog:
+    """
+    Append-only mutation log (one JSON record per line) with background compaction.
+    Compaction rotates the live log to '<path>.old', writes a fresh snapshot of the tree
+    in a worker thread (tmp file + os.replace) and then drops the rotated segment.
+    Startup replays: snapshot -> '<path>.old' (if a compaction was interrupted) -> live log.
+    """
+    def __init__(self, path, snapshot_path, compact_bytes=WAL_COMPACT_BYTES, sync=True):
+        self.path = path
+        self.old_path = path + '.old'
+        self.snapshot_path = snapshot_path
+        self.compact_bytes = compact_bytes
+        self.sync = sync
+        self._file = None
+        self._lock = threading.Lock()
+        self._compactor = None
+
+    @metrics.timed('btree_persist_seconds{kind="wal"}')
+    def append(self, *records):
+        """Writes the records and syncs once for the whole group. Returns the log size."""
+        data = ''.join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + '\n' for r in records)
+        with self._lock:
+            if self._file is None: self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(data)
+            self._file.flush()
+            if self.sync: getattr(os, 'fdatasync', os.fsync)(self._file.fileno())
+            return self._file.tell()
+
+    def replay(self):
+        """Yields logged records in order. A torn last line (crash mid-append) is ignored."""
+        for path in (self.old_path, self.path):
+            if not os.path.exists(path): continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try: yield json.loads(line)
+                    except ValueError: break
+
+    def needs_compaction(self, size):
+        return size >= self.compact_bytes and not self.compacting()
+
+    def compacting(self):
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def compact(self, books, m, background=True):
+        """
+        Snapshots `books` (the full in-order list at this instant) and truncates the log.
+        Book objects are never mutated in place, so the list is safe to serialize off-thread.
+        """
+        with self._lock:
+            if self.compacting():
+                if background: return False
+                self._compactor.join()      # Snapshot đồng bộ: chờ lần gộp đang chạy rồi gộp tiếp
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                if os.path.exists(self.old_path):
+                    # Lần gộp trước bị gián đoạn: nối log hiện tại vào đoạn cũ, không ghi đè
+                    with open(self.path, 'r', encoding='utf-8') as src, open(self.old_path, 'a', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                    os.remove(self.path)
+                else:
+                    os.replace(self.path, self.old_path)
+            self._compactor = threading.Thread(target=self._write_snapshot, args=(books, m), daemon=True)
+            self._compactor.start()
+        if not background: self._compactor.join()
+        return True
+
+    def truncate(self):
+        """Drops the log once its records are covered by a page-file checkpoint."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            for path in (self.old_path, self.path):
+                if os.path.exists(path): os.remove(path)
+
+    def _write_snapshot(self, books, m):
+        write_snapshot(self.snapshot_path, books, m)
+        if os.path.exists(self.old_path): os.remove(self.old_path)
+
+
+wal = WriteAheadLog(WAL_FILE, SNAPSHOT_FILE)
+
+def log_mutation(*records):
+    """Appends mutations to the WAL; kicks off a background compaction once the log is large."""
+    size = wal.append(*records)
+    if wal.needs_compaction(size): save_data(background=True)
+
+def save_data(background=False):
+    """Full snapshot of the current tree (compacts the WAL). A paged tree checkpoints its pages instead."""
+    if btree.pool is not None:
+        btree.checkpoint()
+        wal.truncate()
+    else: wal.compact(btree.get_all_books(), btree.m, background=background)
+
+def _open_page_file():
+    """Opens PAGE_FILE: only the meta slot is read, pages are faulted in on demand."""
+    page_file = PageFile(PAGE_FILE)
+    return BTree(m=page_file.m, pool=BufferPool(page_file, BUFFER_POOL_PAGES))
+
+def _new_tree(books=(), m=5, progress=None, old=None):
+    """
+    Bulk-loads a catalogue tree from sorted books: in memory, or into a new page file swapped in with os.replace.
+    `old`, the tree being replaced, is closed only once the new one is complete: if the build raises
+    (ValueError on a bad record) it is left open and still serves requests.
+    """
+    if not PAGE_FILE:
+        tree = BTree.bulk_load(books, m=m, progress=progress, codec=_key_codec())
+        if old is not None: old.close()
+        return tree
+    tmp = PAGE_FILE + '.tmp'
+    if os.path.exists(tmp): os.remove(tmp)
+    pool = BufferPool(PageFile(tmp, m=m), BUFFER_POOL_PAGES)
+    try:
+        tree = BTree.bulk_load(books, m=m, pool=pool, progress=progress,
+                               workers=BUILD_WORKERS if isinstance(books, list) and len(books) >= PARALLEL_BUILD_MIN else 1)
+        tree.checkpoint()
+    except BaseException:
+        pool.file.close()
+        os.remove(tmp)
+        raise
+    tree.close()
+    if old is not None: old.close()      # Đóng mmap cũ trước os.replace (Windows không thay được file đang map)
+    os.replace(tmp, PAGE_FILE)
+    return _open_page_file()
+
+def _is_sorted_unique(books):
+    return all(a.ma_sach < b.ma_sach for a, b in zip(books, itertools.islice(books, 1, None)))
 
-def save_data():
-    books = btree.get_all_books()
-    payload = {'config': {'m': btree.m}, 'data': [b.to_dict() for b in books]}
-    with open(DATA_FILE, 'w', encoding='utf-8') as f: json.dump(payload, f, ensure_ascii=False, indent=2)
+def _apply_log_record(tree, rec):
+    op = rec.get('op')
+    if op == 'add':
+        b = rec['book']
+        tree.insert(Book(b['ma_sach'], b['ten_sach'], b['tac_gia']), trace=False)
+    elif op == 'del':
+        tree.delete(rec['ma_sach'], trace=False)
+    elif op == 'config':
+        tree = _new_tree(tree.get_all_books(), m=rec['m'], old=tree)
+    elif op == 'reset':
+        tree = _new_tree(m=tree.m, old=tree)
+    return tree
 
 def load_data():
     global btree
-    if os.path.exists(DATA_FILE):
+    try:
+        if PAGE_FILE and os.path.exists(PAGE_FILE):
+            tree = _open_page_file()                  # Không phải đọc toàn bộ dữ liệu khi khởi động
+        elif os.path.exists(SNAPSHOT_FILE):
+            books, m_val, is_sorted = read_snapshot(SNAPSHOT_FILE)
+            if is_sorted or KEY_CODEC_PREFIX:     # Snapshot luôn theo thứ tự khóa (cờ sorted so chuỗi; có codec thì bulk_load sắp lại theo số)
+                tree = _new_tree(books, m=m_val)
+            else:
+                tree = BTree(m=m_val)
+                for b in books: tree.insert(b, trace=False)
+                if PAGE_FILE: tree = _new_tree(tree.get_all_books(), m=m_val)
+        elif os.path.exists(DATA_FILE):               # Lần chạy đầu: nhập từ JSON theo luồng (file có thể rất lớn)
+            with open(DATA_FILE, 'r', encoding='utf-8') as f, _gc_paused():
+                books, m_val = sorted_catalogue(f)
+                tree = _new_tree(books, m=m_val)
+        else: tree = _new_tree()
+        for rec in wal.replay(): tree = _apply_log_record(tree, rec)
+        btree = _attach_indexes(tree)
+        return True
+    except: return False
+
+if multiprocessing.parent_process() is None: load_data()   # Tiến trình con của bulk_load song song không cần catalogue
+
+# --- BATCH MUTATIONS ---
+def _parse_batch(items, key=str):
+    """
+    Normalizes batch items to (index, op, ma_sach, book) sorted by ma_sach, in the tree's key order
+    (`key`: BTree._key). The sorts are stable, so operations on the same key keep their request order.
+    Invalid items come back separately.
+    """
+    ops, invalid = [], []
+    for idx, item in enumerate(items):
+        op = item.get('op') if isinstance(item, dict) else None
+        ma = str(item.get('ma_sach') or '').strip() if op in ('add', 'del') else ''
+        if not ma:
+            invalid.append(idx)
+            continue
+        book = Book(ma, item.get('ten_sach'), item.get('tac_gia')) if op == 'add' else None
+        ops.append((idx, op, ma, book))
+    ops.sort(key=lambda o: o[2])
+    if key is not str: ops.sort(key=lambda o: key(o[2]))     # Key codec: thứ tự số, mã trùng vẫn liền nhau
+    return ops, invalid
+
+def _batch_sequential(tree, ops, results, records, trace=False):
+    """Applies sorted ops one by one (neighbouring keys reuse the same hot path). Returns the steps if traced."""
+    steps = []
+    for idx, op, ma, book in ops:
         try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                content = json.load(f)
-                data = content.get('data', []) if isinstance(content, dict) else content
-                m_val = content.get('config', {}).get('m', 5) if isinstance(content, dict) else 5
-                btree = BTree(m=m_val)
-                for item in data: btree.insert(Book(item['ma_sach'], item['ten_sach'], item['tac_gia']))
-            return True
-        except: return False
-    return False
-
-load_data()
+            if op == 'add':
+                ok = tree.insert(book, trace=trace)
+                results[idx]['status'] = 'added' if ok else 'duplicate'
+                if ok: records.append({'op': 'add', 'book': book.to_dict()})
+            else:
+                ok = bool(tree.delete(ma, trace=trace))
+                results[idx]['status'] = 'deleted' if ok else 'not_found'
+                if ok: records.append({'op': 'del', 'ma_sach': ma})
+        except ValueError as e: results[idx].update(status='invalid', message=str(e))
+        if trace: steps.extend(tree.steps_log)
+    return steps
+
+def _batch_merge(tree, ops, results, records):
+    """
+    One ordered pass merging the sorted ops into the in-order stream of the tree, then a bulk_load
+    of the result: O(N + B) instead of O(B log N). Returns the merged, sorted book list.
+    """
+    merged, cursor, key = [], tree.iter_books(), tree._key
+    current = next(cursor, None)
+    for _, group in itertools.groupby(ops, key=lambda o: o[2]):
+        group = list(group)
+        ma = group[0][2]
+        while current is not None and key(current.ma_sach) < key(ma):
+            merged.append(current)
+            current = next(cursor, None)
+        state = None
+        if current is not None and current.ma_sach == ma:
+            state = current
+            current = next(cursor, None)
+        for idx, op, _, book in group:
+            if op == 'add':
+                if state is not None:
+                    results[idx]['status'] = 'duplicate'
+                    continue
+                try: tree.check_book(book)
+                except ValueError as e:
+                    results[idx].update(status='invalid', message=str(e))
+                    continue
+                state = book
+                results[idx]['status'] = 'added'
+                records.append({'op': 'add', 'book': book.to_dict()})
+            elif state is None: results[idx]['status'] = 'not_found'
+            else:
+                state = None
+                results[idx]['status'] = 'deleted'
+                records.append({'op': 'del', 'ma_sach': ma})
+        if state is not None: merged.append(state)
+    if current is not None: merged.append(current)
+    merged.extend(cursor)
+    return merged
+
+# --- HTTP CACHING ---
+_ETAG_EPOCH = os.urandom(4).hex()   # version chỉ tăng trong một tiến trình: ETag của lần chạy trước không được khớp
+_payload_cache = OrderedDict()      # (path, query) -> (version, json bytes, gzip bytes | None)
+_payload_lock = threading.Lock()
+
+def cached_json(build):
+    """
+    JSON response for the current request, serialized once per tree version and reused until the
+    next mutation. Sends a weak ETag (epoch + version) and 'Cache-Control: no-cache' so browsers
+    revalidate: a matching If-None-Match gets an empty 304. Large bodies are gzipped when accepted.
+    Call under the read lock so the version cannot move while `build()` runs.
+    """
+    version, key = btree.version, (request.path, request.query_string)
+    etag = f"{_ETAG_EPOCH}-{version}"
+    if request.if_none_match.contains_weak(etag):
+        resp = app.response_class(status=304)
+    else:
+        with _payload_lock:
+            entry = _payload_cache.get(key)
+            if entry is not None: _payload_cache.move_to_end(key)
+        if entry is None or entry[0] != version:
+            entry = [version, app.json.dumps(build(), separators=(',', ':')).encode('utf-8'), None]
+            with _payload_lock:
+                _payload_cache[key] = entry
+                while len(_payload_cache) > PAYLOAD_CACHE_ENTRIES: _payload_cache.popitem(last=False)
+        body = entry[1]
+        if len(body) >= GZIP_MIN_BYTES and 'gzip' in request.accept_encodings:
+            if entry[2] is None: entry[2] = gzip.compress(body, compresslevel=6)
+            resp = app.response_class(entry[2], mimetype='application/json')
+            resp.headers['Content-Encoding'] = 'gzip'
+        else: resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+# --- REQUEST METRICS ---
+class TimedJSONProvider(DefaultJSONProvider):
+    """jsonify / cached_json with serialization time recorded as 'http_serialize_seconds'."""
+    @metrics.timed('http_serialize_seconds')
+    def dumps(self, obj, **kwargs): return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
+@app.before_request
+def _start_request_timer():
+    if metrics.enabled: g.request_t0 = time.perf_counter()
+
+@app.after_request
+def _observe_request(resp):
+    """Per-endpoint request time (a streamed body is counted up to its first byte)."""
+    if 'request_t0' in g:
+        metrics.observe(f'http_request_seconds{{endpoint="{request.endpoint}",method="{request.method}"}}', time.perf_counter() - g.request_t0)
+    return resp
+
+# --- STREAMED STEPS ---
+def stream_steps(op, lock=None):
+    """
+    NDJSON response for a long operation: op(tree) runs in a worker thread under `lock` (the write
+    lock by default) and each animation step is sent as a {'step': ...} line as soon as it is captured,
+    followed by one {'done': true, ...} line with op's result dict. The worker never waits for the
+    client while it holds the lock: when the bounded queue is full, later steps are folded into one
+    pending step (see _fold_step) sent once there is room, so a slow client gets fewer frames instead
+    of stalling every other request. If the client goes away the remaining steps are dropped.
+    """
+    lock = lock or tree_lock.write
+    steps, gone = queue.Queue(maxsize=STREAM_QUEUE_STEPS), threading.Event()
+    pending = {}        # Bước chưa gửi được vì hàng đợi đầy (đã gộp các bước sau nó), xem _fold_step
+    def offer(step):
+        """Sink called under the lock: never blocks."""
+        if gone.is_set(): return
+        if steps.full(): return _fold_step(pending, step)     # Chỉ luồng này thêm vào hàng đợi: không full thì put được
+        if pending:
+            _fold_step(pending, step)
+            step = _folded_step(pending)
+            pending.clear()
+        steps.put_nowait({'step': step})
+    def put(item):
+        while not gone.is_set():
+            try: return steps.put(item, timeout=0.5)
+            except queue.Full: continue
+    def worker():
+        with lock():
+            tree = btree
+            tree._ctx.sink = offer
+            try: result = op(tree)
+            except Exception as e: result = {'success': False, 'message': str(e)}
+            finally: tree._ctx.sink = None
+        result.pop('steps', None)
+        if pending: put({'step': _folded_step(pending)})     # Đã nhả khóa: giờ mới chờ client
+        put({'done': True, **result})
+    def generate():
+        try:
+            while True:
+                item = steps.get()
+                yield json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n'
+                if item.get('done'): return
+        finally: gone.set()
+    threading.Thread(target=worker, daemon=True).start()
+    return app.response_class(generate(), mimetype='application/x-ndjson', headers={'Cache-Control': 'no-cache'})
+
+def _fold_step(pending, step):
+    """
+    Folds a step the client has not been sent into `pending` ({'step', 'nodes'}): a full snapshot
+    replaces what was pending; a delta adds its nodes by id (the later copy wins, as when the client
+    replays them) and its message / highlights replace the older ones. A pending full tree is
+    flattened to shallow nodes first, since a delta listing every live node rebuilds the same tree.
+    """
+    if pending and 'delta' in step:
+        if 'tree' in pending['step']: _flatten_tree(pending['step']['tree'], pending['nodes'])
+        pending['nodes'].update((n['id'], n) for n in step['delta']['nodes'])
+        pending['step'] = step
+    else:
+        pending['step'] = step
+        pending['nodes'] = {n['id']: n for n in step['delta']['nodes']} if 'delta' in step else {}
+
+def _folded_step(pending):
+    step = pending['step']
+    if 'delta' not in step: return step
+    return {**step, 'delta': {'root': step['delta']['root'], 'nodes': list(pending['nodes'].values())}}
+
+def _flatten_tree(tree, nodes):
+    """Nested to_dict() form -> {id: to_delta() form}; returns the root id."""
+    nodes[tree['id']] = {**tree, 'children': [_flatten_tree(c, nodes) for c in tree['children']]}
+    return tree['id']
+
+def _stream_requested(): return request.args.get('stream') == '1'
+
+def _parse_limit(value, default=100, cap=1000):
+    """Page size from a request, clamped to [1, cap]. Raises ValueError if it is not an integer."""
+    try: return max(1, min(int(default if value is None else value), cap))
+    except (TypeError, ValueError): raise ValueError(f"limit phải là số nguyên: {value!r}")
+
+def _trace_requested(default='1'):
+    """Per-request instrumentation switch: '?trace=0' skips step messages and snapshots."""
+    return request.args.get('trace', default) != '0'
 
 @app.route('/')
 def index(): return render_template('index.html')
 
 @app.route('/api/books', methods=['GET'])
-def get_books(): return jsonify([b.to_dict() for b in btree.get_all_books()])
+@reads
+def get_books():
+    """Full in-order dump, or one page when '?limit=<n>' / '?after=<ma_sach>' is given. Cached per tree version."""
+    if 'limit' not in request.args and 'after' not in request.args:
+        return cached_json(lambda: [b.to_dict() for b in btree.iter_books()])
+    try: limit = _parse_limit(request.args.get('limit'))
+    except ValueError as e: return jsonify({'success': False, 'message': str(e)})
+    def build():
+        page = list(itertools.islice(btree.iter_books(after=request.args.get('after')), limit + 1))
+        next_after = page[limit - 1].ma_sach if len(page) > limit else None
+        return {'books': [b.to_dict() for b in page[:limit]], 'next_after': next_after, 'total': btree.size}
+    return cached_json(build)
 
 @app.route('/api/tree', methods=['GET'])
-def get_tree(): return jsonify({**btree.get_tree_structure(), 'm': btree.m})
+@reads
+def get_tree():
+    """
+    The whole tree, or a level-of-detail view: '?depth=k' keeps k levels and stubs the rest,
+    '?root=0.2' starts at a child path (dot-separated child indexes from the root). Cached per tree version.
+    """
+    depth, root = request.args.get('depth', type=int), request.args.get('root', '')
+    if depth is None and not root: return cached_json(lambda: {**btree.get_tree_structure(), 'm': btree.m, 'version': btree.version})
+    try:
+        path = [int(i) for i in root.split('.') if i]
+        btree.node_at(path)
+    except (ValueError, IndexError) as e: return jsonify({'success': False, 'message': f"root không hợp lệ: {e}"})
+    depth = max(1, depth) if depth is not None else None
+    return cached_json(lambda: {**btree.get_tree_view(depth, path), 'm': btree.m, 'version': btree.version})
 
 @app.route('/api/books', methods=['POST'])
+@writes
 def add_book():
     data = request.json
     ma = str(data.get('ma_sach')).strip()
-    if btree.search(ma): return jsonify({'success': False, 'message': 'Mã trùng'})
-    btree.insert(Book(ma, data.get('ten_sach'), data.get('tac_gia')))
-    save_data()
+    book = Book(ma, data.get('ten_sach'), data.get('tac_gia'))
+    try:
+        if not btree.insert(book, trace=_trace_requested()): return jsonify({'success': False, 'message': 'Mã trùng'})
+    except ValueError as e: return jsonify({'success': False, 'message': str(e)})
+    log_mutation({'op': 'add', 'book': book.to_dict()})
     return jsonify({'success': True, 'message': 'Thêm thành công', 'steps': btree.steps_log, 'affected_nodes': btree.get_affected_nodes_data()})
 
 @app.route('/api/books/random', methods=['POST'])
+@writes
 def add_random_book():
     try:
-        ma = f"BK-{random.randint(1, 9999):04d}"
-        while btree.search(ma): ma = f"BK-{random.randint(1, 9999):04d}"
+        ma = btree.id_allocator.random_id()
         ten = f"{random.choice(LIBRARY_DATA['prefixes'])} {random.choice(LIBRARY_DATA['subjects'])} {random.choice(LIBRARY_DATA['suffixes'])}"
         tac = f"{random.choice(LIBRARY_DATA['authors_last'])} {random.choice(LIBRARY_DATA['authors_first'])}"
-        btree.insert(Book(ma, ten, tac))
-        save_data()
+        book = Book(ma, ten, tac)
+        btree.insert(book, trace=_trace_requested())
+        log_mutation({'op': 'add', 'book': book.to_dict()})
         return jsonify({'success': True, 'message': f"Random: {ma}", 'steps': btree.steps_log, 'affected_nodes': btree.get_affected_nodes_data(), 'book': {'ma_sach': ma}})
     except Exception as e: return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/api/books/generate_bulk', methods=['POST'])
+@writes
 def generate_bulk_books():
+    """Adds `count` random books. '?stream=1' animates every insert and streams the steps (NDJSON)."""
+    try: count = int(request.json.get('count', 10))
+    except Exception as e: return jsonify({'success': False, 'message': str(e)})
+    if _stream_requested(): return stream_steps(lambda tree: _generate_bulk(tree, count, trace=True))
+    return jsonify(_generate_bulk(btree, count))
+
+def _generate_bulk(tree, count, trace=False):
     try:
-        count = int(request.json.get('count', 10))
         added = 0
-        btree.steps_log = [] 
-        curr_max = 0
-        for b in btree.get_all_books():
-            if b.ma_sach.startswith("BK-"):
-                try: curr_max = max(curr_max, int(b.ma_sach.split('-')[1]))
-                except: continue
-        
-        start = curr_max + 1
+        tree.steps_log = [] 
+        ids, records, note = tree.id_allocator, [], ""
         for i in range(count):
-            ma = f"BK-{start + i:04d}"
-            if btree.search(ma): continue
+            try: ma = ids.next_id()
+            except ValueError as e:
+                note = f" {e}."
+                break
             ten = f"{random.choice(LIBRARY_DATA['prefixes'])} {random.choice(LIBRARY_DATA['subjects'])}"
             tac = f"{random.choice(LIBRARY_DATA['authors_last'])} {random.choice(LIBRARY_DATA['authors_first'])}"
-            btree.insert(Book(ma, ten, tac))
+            book = Book(ma, ten, tac)
+            if not tree.insert(book, trace=trace): continue
+            records.append({'op': 'add', 'book': book.to_dict()})
             added += 1
-        save_data()
-        return jsonify({'success': True, 'message': f"Đã thêm {added} cuốn."})
-    except Exception as e: return jsonify({'success': False, 'message': str(e)})
+        if records: log_mutation(*records)
+        return {'success': True, 'message': f"Đã thêm {added} cuốn.{note}"}
+    except Exception as e: return {'success': False, 'message': str(e)}
+
+@app.route('/api/books/batch', methods=['POST'])
+@writes
+def batch_books():
+    """
+    {'ops': [{'op': 'add', 'ma_sach', 'ten_sach', 'tac_gia'} | {'op': 'del', 'ma_sach'}, ...]}
+    Ops are sorted by key and applied in one ordered pass; a batch that is large next to the tree
+    is merged and bulk-loaded instead. One WAL append for the whole batch; 'results' follows the
+    request order. Steps are only recorded with '?trace=1' (which forces the per-op path).
+    """
+    global btree
+    items = (request.json or {}).get('ops') or []
+    trace = _trace_requested(default='0')
+    ops, invalid = _parse_batch(items, btree._key)
+    results = [{'op': item.get('op') if isinstance(item, dict) else None,
+                'ma_sach': item.get('ma_sach') if isinstance(item, dict) else None} for item in items]
+    for idx in invalid: results[idx].update(status='invalid', message="Cần 'op' là add/del và 'ma_sach'")
+    for idx, _, ma, _ in ops: results[idx]['ma_sach'] = ma
+    records, steps = [], []
+    mode = 'merge' if not trace and len(ops) >= BATCH_MERGE_RATIO * btree.size and len(ops) > 1 else 'sequential'
+    if mode == 'merge':
+        merged = _batch_merge(btree, ops, results, records)
+        if records:
+            try: btree = _attach_indexes(_new_tree(merged, m=btree.m, old=btree))
+            except ValueError as e: return jsonify({'success': False, 'message': str(e)})     # Cây cũ vẫn nguyên
+    else: steps = _batch_sequential(btree, ops, results, records, trace=trace)
+    if records: log_mutation(*records)
+    counts = {k: sum(1 for r in results if r['status'] == k) for k in ('added', 'deleted', 'duplicate', 'not_found', 'invalid')}
+    message = f"Lô {len(items)} thao tác: thêm {counts['added']}, xóa {counts['deleted']}, bỏ qua {len(items) - counts['added'] - counts['deleted']}."
+    return jsonify({'success': True, 'message': message, 'mode': mode, 'counts': counts, 'results': results, 'steps': steps})
 
 @app.route('/api/books/search/<ma>', methods=['GET'])
+@reads
 def search_book(ma):
-    f = btree.search_with_animation(ma)
+    f = btree.search_with_animation(ma, trace=_trace_requested())
     return jsonify({'success': bool(f), 'book': f.to_dict() if f else None, 'steps': btree.steps_log})
 
+@app.route('/api/books/multi_get', methods=['POST'])
+@reads
+def multi_get_books():
+    """{'keys': [ma_sach, ...]} -> one result per key (request order), read in a single tree traversal."""
+    keys = [str(k).strip() for k in (request.json or {}).get('keys') or []]
+    found, stats = btree.multi_get(keys)
+    hits = sum(1 for k in keys if found[k])
+    return jsonify({
+        'success': True,
+        'message': f"Tìm thấy {hits}/{len(keys)} mã; đọc {stats['visited']} nodes (tra từng mã: {stats['baseline']}).",
+        'results': [{'ma_sach': k, 'found': bool(found[k]), 'book': found[k].to_dict() if found[k] else None} for k in keys],
+        'visited_nodes': stats['visited'], 'baseline_nodes': stats['baseline'], 'total_nodes': btree.node_count
+    })
+
+@app.route('/api/books/multi_range', methods=['POST'])
+@reads
+def multi_range_books():
+    """{'ranges': [{'min_key', 'max_key'}, ...]} -> the books of each range, read in a single tree traversal."""
+    ranges = (request.json or {}).get('ranges') or []
+    intervals = [(str(r.get('min_key')).strip(), str(r.get('max_key')).strip()) for r in ranges]
+    results, stats = btree.multi_range(intervals)
+    return jsonify({
+        'success': True,
+        'message': f"{len(intervals)} khoảng, {sum(map(len, results))} cuốn; đọc {stats['visited']} nodes (từng khoảng riêng: {stats['baseline']}).",
+        'ranges': [{'min_key': lo, 'max_key': hi, 'books': [b.to_dict() for b in books]} for (lo, hi), books in zip(intervals, results)],
+        'visited_nodes': stats['visited'], 'baseline_nodes': stats['baseline'], 'total_nodes': btree.node_count
+    })
+
 @app.route('/api/books/range', methods=['POST'])
+@reads
 def search_range():
+    """
+    Range query streamed from the tree cursor. Optional 'limit' and 'after' (continuation token =
+    last ma_sach of the previous page). The animated batch scan walks the whole range, so it only
+    runs for an unpaged query (no limit, no after); a page is read from the cursor alone.
+    '?stream=1' sends the scan steps as NDJSON while it runs.
+    """
     d = request.json
-    results, msg = btree.search_range_optimized(d.get('min_key'), d.get('max_key'))
-    return jsonify({
+    if _stream_requested(): return stream_steps(lambda tree: _search_range(tree, d, trace=True), lock=tree_lock.read)
+    return jsonify(_search_range(btree, d, trace=_trace_requested()))
+
+def _search_range(tree, d, trace=True):
+    min_key, max_key = str(d.get('min_key')).strip(), str(d.get('max_key')).strip()
+    limit, after = d.get('limit'), d.get('after')
+    try: limit = _parse_limit(limit) if limit else None
+    except ValueError as e: return {'success': False, 'message': str(e)}
+    steps, msg = [], None
+    if trace and after is None and not limit:
+        _, msg = tree.search_range_optimized(min_key, max_key, trace=True)
+        steps = tree.steps_log
+    page = list(itertools.islice(tree.iter_range(min_key, max_key, after=after), limit + 1 if limit else None))
+    next_after = None
+    if limit and len(page) > limit:
+        page = page[:limit]
+        next_after = page[-1].ma_sach
+    if msg is None: msg = f"Tìm thấy {len(page)} cuốn" + (" (còn tiếp)." if next_after else ".")
+    return {
         'success': True, 
         'message': msg, 
-        'books': [b.to_dict() for b in results], 
-        'steps': btree.steps_log
-    })
+        'books': [b.to_dict() for b in page], 
+        'next_after': next_after,
+        'total': tree.count_range(min_key, max_key),
+        'steps': steps
+    }
+
+@app.route('/api/books/count', methods=['GET'])
+@reads
+def count_books():
+    """Count of books in [min, max] from subtree sizes (no scan)."""
+    lo, hi = request.args.get('min', ''), request.args.get('max', '\uffff')
+    return jsonify({'success': True, 'count': btree.count_range(lo, hi), 'total': btree.size})
+
+@app.route('/api/metrics', methods=['GET'])
+@reads
+def get_metrics():
+    """Prometheus text format: operation counters and timers plus O(1) gauges of the current tree."""
+    gauges = [('btree_books', btree.size), ('btree_nodes', btree.node_count), ('btree_height', btree.height()),
+              ('btree_order', btree.m), ('btree_version', btree.version),
+              ('btree_fill_ratio', btree.size / (btree.node_count * btree.max_keys)),
+              ('btree_metrics_enabled', int(metrics.enabled))]
+    counters = []
+    if btree.pool is not None:
+        stats = btree.pool.stats()
+        gauges += [(f'btree_buffer_pool_{k}', stats[k]) for k in ('capacity', 'cached', 'dirty', 'pages')]
+        counters = [(f'btree_buffer_pool_{k}_total', stats[k]) for k in ('hits', 'faults', 'writes')]
+    return app.response_class(metrics.render(gauges, counters), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/tree/health', methods=['GET'])
+@reads
+def tree_health():
+    """On-demand structural report (walks every node): height, per-level occupancy histogram, node count."""
+    return jsonify({'success': True, **btree.health(max(1, request.args.get('buckets', 10, type=int)))})
+
+@app.route('/api/books/rank/<ma>', methods=['GET'])
+@reads
+def rank_book(ma):
+    book = btree.search(ma)
+    return jsonify({'success': True, 'rank': btree.rank(ma), 'found': bool(book), 'total': btree.size})
+
+@app.route('/api/books/select/<int:k>', methods=['GET'])
+@reads
+def select_book(k):
+    """k is 0-based: /api/books/select/49999 returns the 50,000th book."""
+    book = btree.select(k)
+    if not book: return jsonify({'success': False, 'message': f'k phải trong [0, {btree.size - 1}]'})
+    return jsonify({'success': True, 'book': book.to_dict(), 'rank': k})
+
+def _index_lookup(field):
+    """?q=<text>&prefix=1&limit=<n> against a secondary index (accent-insensitive)."""
+    q = request.args.get('q', '')
+    prefix = request.args.get('prefix', '0') == '1'
+    try: limit = _parse_limit(request.args.get('limit'))
+    except ValueError as e: return jsonify({'success': False, 'message': str(e)})
+    books = btree.indexes[field].lookup(q, prefix=prefix, limit=limit)
+    return jsonify({'success': True, 'books': [b.to_dict() for b in books], 'ma_sach': [b.ma_sach for b in books]})
+
+@app.route('/api/books/by_author', methods=['GET'])
+@reads
+def books_by_author(): return _index_lookup('tac_gia')
+
+@app.route('/api/books/by_title', methods=['GET'])
+@reads
+def books_by_title(): return _index_lookup('ten_sach')
 
 @app.route('/api/books/<ma>', methods=['DELETE'])
+@writes
 def delete_book(ma):
-    if not btree.search(ma): return jsonify({'success': False, 'message': 'Không thấy'})
-    btree.delete(ma)
-    save_data()
-    return jsonify({'success': True, 'message': 'Đã xóa', 'steps': btree.steps_log, 'affected_nodes': btree.get_affected_nodes_data()})
+    """Deletes one book. '?stream=1' streams the steps (cascading merges/borrows) as NDJSON."""
+    if _stream_requested(): return stream_steps(lambda tree: _delete(tree, ma, trace=True))
+    return jsonify(_delete(btree, ma, trace=_trace_requested()))
+
+def _delete(tree, ma, trace=True):
+    if not tree.delete(ma, trace=trace): return {'success': False, 'message': 'Không thấy'}
+    log_mutation({'op': 'del', 'ma_sach': str(ma)})
+    return {'success': True, 'message': 'Đã xóa', 'steps': tree.steps_log, 'affected_nodes': tree.get_affected_nodes_data()}
+
+@app.route('/api/export', methods=['GET'])
+@reads
+def export_json():
+    """The whole catalogue in the JSON import/export format, as a file download."""
+    resp = jsonify({'config': {'m': btree.m}, 'data': [b.to_dict() for b in btree.iter_books()]})
+    resp.headers['Content-Disposition'] = 'attachment; filename=books_data.json'
+    return resp
+
+@app.route('/api/import', methods=['POST'])
+@writes
+def import_json():
+    """
+    Replaces the catalogue with a JSON export, a JSON array or JSON lines (same ma_sach twice: the last one wins).
+    The body is parsed as a stream and external-sorted, so large uploads never sit in memory as one document.
+    """
+    global btree
+    with _gc_paused():
+        try:
+            books, m = sorted_catalogue(io.TextIOWrapper(request.stream, encoding='utf-8'), m=request.args.get('m', type=int))
+            tree = _new_tree(books, m=m, old=btree)     # Bản ghi sai chỉ làm hỏng lần nhập này: cây cũ vẫn mở
+        except ValueError as e: return jsonify({'success': False, 'message': str(e)})
+        btree = _attach_indexes(tree)
+    save_data()     # Snapshot đồng bộ: lần nhập không có bản ghi WAL tương ứng
+    return jsonify({'success': True, 'message': f'Đã nhập {btree.size} cuốn (m={m}).'})
 
 @app.route('/api/config/degree', methods=['POST'])
+@writes
 def update_degree():
     global btree
     m = int(request.json.get('m', 5))
     if m < 3: return jsonify({'success': False, 'message': 'm >= 3'})
-    books = btree.get_all_books()
-    btree = BTree(m=m)
-    for b in books: btree.insert(b)
-    save_data()
+    try: btree = _attach_indexes(_new_tree(btree.get_all_books(), m=m, old=btree))
+    except ValueError as e: return jsonify({'success': False, 'message': str(e)})
+    log_mutation({'op': 'config', 'm': m})
+    save_data(background=True)
     return jsonify({'success': True, 'message': f'Đã đổi m={m}'})
 
 @app.route('/api/reset', methods=['POST'])
+@writes
 def reset():
     global btree
-    m = btree.m
-    btree = BTree(m=m)
-    save_data()
+    btree = _attach_indexes(_new_tree(m=btree.m, old=btree))
+    log_mutation({'op': 'reset'})
+    save_data(background=True)
     return jsonify({'success': True, 'message': 'Đã reset'})
 
 if __name__ == '__main__':
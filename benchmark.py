@@ -0,0 +1,476 @@
+# File: benchmark.py
+# Đo hiệu năng các thao tác B-Tree (chạy: python benchmark.py [lookup|stress|snapshot|memory|parallel|suite|compare])
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import app
+from app import BTree, Book
+
+N_BOOKS = 100_000
+N_QUERIES = 20_000
+DEGREES = [5, 64, 128, 256, 512]
+
+def make_books(n, seed=42):
+    rnd = random.Random(seed)
+    ids = rnd.sample(range(1, n * 10), n)
+    return [Book(f"BK-{i:07d}", f"Sách {i}", f"Tác giả {i % 97}") for i in ids]
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+def linear_search(tree, ma_sach):
+    """Reference: the per-node linear scan used before node lookups moved to bisect."""
+    node = tree.root
+    while True:
+        i = 0
+        while i < len(node.keys) and ma_sach > node.keys[i].ma_sach: i += 1
+        if i < len(node.keys) and ma_sach == node.keys[i].ma_sach: return node.keys[i]
+        if node.leaf: return None
+        node = node.children[i]
+
+def bench_lookup():
+    """Point lookups (linear scan vs bisect) and silent insert/delete throughput per degree m."""
+    books = make_books(N_BOOKS)
+    queries = [b.ma_sach for b in random.Random(7).sample(books, N_QUERIES)]
+    print(f"N={N_BOOKS:,} sách, {N_QUERIES:,} truy vấn")
+    print(f"{'m':>5} | {'linear (µs/op)':>15} | {'bisect (µs/op)':>15} | {'x':>5} | {'insert (µs/op)':>15} | {'delete (µs/op)':>15}")
+    for m in DEGREES:
+        tree = BTree(m=m)
+        t_ins = timed(lambda: [tree.insert(b, trace=False) for b in books])
+        t_lin = timed(lambda: [linear_search(tree, q) for q in queries])
+        t_bis = timed(lambda: [tree.search(q) for q in queries])
+        t_del = timed(lambda: [tree.delete(q, trace=False) for q in queries])
+        us = lambda t, n: t / n * 1e6
+        print(f"{m:>5} | {us(t_lin, N_QUERIES):>15.2f} | {us(t_bis, N_QUERIES):>15.2f} | {t_lin / t_bis:>5.1f} | "
+              f"{us(t_ins, N_BOOKS):>15.2f} | {us(t_del, N_QUERIES):>15.2f}")
+
+SNAPSHOT_SIZES = [10_000, 100_000, 1_000_000]
+
+def bench_snapshot():
+    """JSON vs binary snapshot: file size, write time, parse time and full startup (parse + bulk_load)."""
+    tmp = tempfile.mkdtemp()
+    json_path, bin_path = os.path.join(tmp, 'snap.json'), os.path.join(tmp, 'snap.bin')
+    print(f"{'N':>9} | {'định dạng':>9} | {'kích thước':>11} | {'ghi (s)':>8} | {'đọc (s)':>8} | {'khởi động (s)':>13}")
+    for n in SNAPSHOT_SIZES:
+        books = sorted(make_books(n), key=lambda b: b.ma_sach)
+        def write_json():
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump({'config': {'m': 64}, 'data': [b.to_dict() for b in books]}, f, ensure_ascii=False)
+        def read_json():
+            with open(json_path, 'r', encoding='utf-8') as f: data = json.load(f)['data']
+            return [Book(item['ma_sach'], item['ten_sach'], item['tac_gia']) for item in data]
+        formats = [('json', json_path, write_json, read_json),
+                   ('binary', bin_path, lambda: app.write_snapshot(bin_path, books, 64), lambda: app.read_snapshot(bin_path)[0])]
+        for name, path, write, read in formats:
+            t_write = timed(write)
+            t_read = timed(read)
+            t_start = timed(lambda: BTree.bulk_load(read(), m=64))
+            print(f"{n:>9,} | {name:>9} | {os.path.getsize(path) / 2**20:>8.1f} MB | {t_write:>8.2f} | {t_read:>8.2f} | {t_start:>13.2f}")
+        del books
+
+class LegacyBook:
+    """Reference: Book before __slots__ / interning (one __dict__ per instance)."""
+    def __init__(self, ma_sach, ten_sach, tac_gia):
+        self.ma_sach = str(ma_sach).strip()
+        self.ten_sach = ten_sach
+        self.tac_gia = tac_gia
+
+class LegacyNode(app.BTreeNode):
+    """Reference: BTreeNode before __slots__ (subclassing restores the __dict__; leaves own an empty list)."""
+    def __init__(self, leaf=True):
+        super().__init__(leaf)
+        self.children = []
+
+def traced_bytes(fn):
+    """(result, bytes still allocated by fn) measured with tracemalloc."""
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return result, used
+
+def bench_memory(n=N_BOOKS, m=64):
+    """Bytes per book (tracemalloc) for the book records alone and for records + B-tree, before and after."""
+    rnd = random.Random(42)
+    rows = [(i, rnd.randrange(97)) for i in sorted(rnd.sample(range(1, n * 10), n))]
+    print(f"N={n:,} sách, m={m}")
+    print(f"{'phiên bản':>10} | {'Book (B/sách)':>14} | {'Book + cây (B/sách)':>20}")
+    slotted_node = app.BTreeNode
+    for name, book_cls, node_cls in (('trước', LegacyBook, LegacyNode), ('sau', Book, slotted_node)):
+        # Chuỗi được tạo trong lúc đo (như khi đọc từ file): tên tác giả trùng nhưng là các object riêng
+        books, b_books = traced_bytes(lambda: [book_cls(f"BK-{i:07d}", f"Sách {i}", f"Tác giả {a}") for i, a in rows])
+        app.BTreeNode = node_cls
+        try: tree, b_tree = traced_bytes(lambda: BTree.bulk_load(books, m=m))
+        finally: app.BTreeNode = slotted_node
+        print(f"{name:>10} | {b_books / n:>14.1f} | {(b_books + b_tree) / n:>20.1f}")
+        del books, tree
+
+PARALLEL_SIZES = [200_000, 1_000_000]
+
+def bench_parallel(m=64, max_workers=None):
+    """
+    Wall-clock time of rebuilding a paged tree (bulk_load into a fresh page file + checkpoint) with
+    1..N worker processes; speedup is against the serial build. The in-memory build is shown for reference.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    tmp = tempfile.mkdtemp()
+    print(f"m={m}, {os.cpu_count()} CPU")
+    print(f"{'N':>9} | {'cách dựng':>14} | {'thời gian (s)':>13} | {'tăng tốc':>8}")
+    for n in PARALLEL_SIZES:
+        books = sorted(make_books(n), key=lambda b: b.ma_sach)
+        print(f"{n:>9,} | {'trong RAM':>14} | {timed(lambda: BTree.bulk_load(books, m=m)):>13.2f} | {'':>8}")
+        serial = None
+        for workers in range(1, max_workers + 1):
+            path = os.path.join(tmp, f"build-{n}-{workers}.pages")
+            def build():
+                tree = BTree.bulk_load(books, m=m, pool=app.BufferPool(app.PageFile(path, m=m)), workers=workers)
+                tree.checkpoint()
+                tree.close()
+            elapsed = timed(build)
+            serial = serial or elapsed
+            os.remove(path)
+            print(f"{n:>9,} | {f'{workers} tiến trình':>14} | {elapsed:>13.2f} | {serial / elapsed:>7.2f}x")
+        del books
+
+def check_tree(tree):
+    """Asserts the B-tree invariants (ordering, fill, uniform depth, sizes, node_count). Returns the key count."""
+    depths, keys, nodes = set(), [], [0]
+    resolve = tree._resolve or (lambda child: child)    # cây phân trang: con là số trang
+    def walk(node, depth, is_root):
+        nodes[0] += 1
+        children = [resolve(c) for c in node.children]
+        assert node.ids == [tree._key(k.ma_sach) for k in node.keys], "ids lệch keys"
+        assert len(node.keys) <= tree.max_keys, "tràn node"
+        assert is_root or len(node.keys) >= tree.min_keys, "thiếu hụt node"
+        assert node.size == len(node.keys) + sum(c.size for c in children), "size sai"
+        if node.leaf: depths.add(depth)
+        else: assert len(children) == len(node.keys) + 1, "số con sai"
+        for i, k in enumerate(node.keys):
+            if not node.leaf: walk(children[i], depth + 1, False)
+            keys.append(tree._key(k.ma_sach))
+        if not node.leaf: walk(children[-1], depth + 1, False)
+    walk(tree.root, 0, True)
+    assert len(depths) <= 1, "lá không cùng độ sâu"
+    assert all(a < b for a, b in zip(keys, keys[1:])), "sai thứ tự khóa"
+    assert nodes[0] == tree.node_count, "node_count sai"
+    return len(keys)
+
+STRESS_THREADS = 16
+STRESS_OPS = 100
+
+def stress(threads=STRESS_THREADS, ops=STRESS_OPS, m=4):
+    """
+    Hammers the Flask routes from many threads (disjoint key ranges for writers, mixed readers)
+    and checks that every response carries only its own steps and that the final tree is exact.
+    Runs against a fresh tree and a throwaway WAL so the real catalogue is untouched.
+    """
+    sys.setswitchinterval(1e-4)   # Đổi luồng thường xuyên để lộ race condition
+    tmp = tempfile.mkdtemp()
+    app.wal = app.WriteAheadLog(os.path.join(tmp, 'wal'), os.path.join(tmp, 'snap.json'), sync=False)
+    app.btree = app._attach_indexes(BTree(m=m))
+    app.btree.indexes['tac_gia'].ensure_built()
+    expected, errors, lock = set(), [], threading.Lock()
+
+    def writer(tid):
+        client, rnd, mine = app.app.test_client(), random.Random(tid), []
+        for i in range(ops):
+            if mine and rnd.random() < 0.3:
+                ma = mine.pop(rnd.randrange(len(mine)))
+                r = client.delete(f"/api/books/{ma}").get_json()
+                ok = r['success'] and ma in r['steps'][0]['message']
+            else:
+                ma = f"T{tid:02d}-{i:05d}"
+                r = client.post("/api/books", json={'ma_sach': ma, 'ten_sach': f"Sách {i}", 'tac_gia': f"Tác giả {tid}"}).get_json()
+                ok = r['success'] and ma in r['steps'][0]['message'] and 'tree' in r['steps'][0]
+                mine.append(ma)
+            if not ok:
+                with lock: errors.append(f"{ma}: step log bị trộn")
+        with lock: expected.update(mine)
+
+    def reader(tid):
+        client, rnd = app.app.test_client(), random.Random(-tid)
+        for _ in range(ops):
+            lo = f"T{rnd.randrange(threads):02d}"
+            r = client.post("/api/books/range?trace=1", json={'min_key': lo, 'max_key': lo + "\uffff"}).get_json()
+            got = [b['ma_sach'] for b in r['books']]
+            if len(got) != len(set(got)) or any(not g.startswith(lo) for g in got):
+                with lock: errors.append(f"range {lo}: kết quả sai")
+            client.get("/api/tree")
+            client.get("/api/books/count")
+
+    workers = [threading.Thread(target=writer, args=(t,)) for t in range(threads // 2)]
+    workers += [threading.Thread(target=reader, args=(t,)) for t in range(threads - threads // 2)]
+    t0 = time.perf_counter()
+    for w in workers: w.start()
+    for w in workers: w.join()
+    elapsed = time.perf_counter() - t0
+    sys.setswitchinterval(0.005)
+
+    n = check_tree(app.btree)
+    assert {b.ma_sach for b in app.btree.iter_books()} == expected, "nội dung cây khác kỳ vọng"
+    assert n == app.btree.size == app.btree.indexes['tac_gia'].tree.size, "chỉ mục phụ lệch"
+    assert not errors, errors[:5]
+    print(f"stress OK: {threads} luồng x {ops} thao tác trong {elapsed:.1f}s, {n} sách còn lại")
+    frames = check_stalled_stream()
+    print(f"stream OK: client ngừng đọc không chặn request khác, {frames} bước (đã gộp) dựng lại đúng cây")
+
+def replay_keys(steps):
+    """Rebuilds the last frame the way the client does (full tree, then delta nodes by id); returns its keys in order."""
+    nodes, root = {}, None
+    def flatten(tree):
+        nodes[tree['id']] = {**tree, 'children': [flatten(c) for c in tree['children']]}
+        return tree['id']
+    for step in steps:
+        if 'tree' in step:
+            nodes.clear()
+            root = flatten(step['tree'])
+        elif 'delta' in step:
+            nodes.update((d['id'], d) for d in step['delta']['nodes'])
+            root = step['delta']['root']
+    def walk(node_id):
+        node = nodes[node_id]
+        for i, k in enumerate(node['keys']):
+            if not node['leaf']: yield from walk(node['children'][i])
+            yield k['ma_sach']
+        if not node['leaf']: yield from walk(node['children'][-1])
+    return list(walk(root))
+
+def check_stalled_stream(count=300, timeout=5.0):
+    """
+    A streamed operation whose client reads one line and stops must not keep the tree locked:
+    a concurrent request still completes, and the steps read afterwards (coalesced while the
+    queue was full) still rebuild the final tree. Returns the number of step lines received.
+    """
+    resp = app.app.test_client().post("/api/books/generate_bulk?stream=1", json={'count': count}, buffered=False)
+    lines = iter(resp.response)
+    first = json.loads(next(lines))
+    done = threading.Event()
+    def other():
+        app.app.test_client().get("/api/books?limit=1")
+        done.set()
+    threading.Thread(target=other, daemon=True).start()
+    assert done.wait(timeout), f"client stream ngừng đọc làm treo request khác quá {timeout}s"
+    items = [first] + [json.loads(line) for line in lines]
+    assert items[-1].get('done') and items[-1]['success'], items[-1]
+    steps = [item['step'] for item in items[:-1]]
+    assert 'tree' in steps[0], "bước đầu phải chứa cả cây"
+    assert replay_keys(steps) == [b.ma_sach for b in app.btree.iter_books()], "các bước đã gộp dựng lại sai cây"
+    return len(steps)
+
+# --- Bộ benchmark tái lập: python benchmark.py suite [--sizes ...] [--out file.json] ---
+SUITE_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+SUITE_DEGREES = [5, 64, 256]
+DISTRIBUTIONS = ('sequential', 'random', 'skewed')
+SUITE_OPS = 1_000           # Số thao tác đo cho mỗi (phân bố, N, m, tầng, thao tác) khi tắt log bước
+SUITE_TRACED_OPS = 20       # Khi bật log bước: bước đầu mỗi thao tác chứa cả cây nên ít thao tác hơn
+SUITE_TRACE_MAX_N = 10_000  # Trên ngưỡng này bỏ qua trace=on (mỗi phản hồi là một bản sao cả cây)
+SUITE_MEMORY_OPS = 5        # Thao tác chạy dưới tracemalloc (không tính thời gian) để lấy bộ nhớ đỉnh
+RANGE_SPAN = 100            # Số khóa trong mỗi truy vấn khoảng
+SUITE_OUT = 'benchmark_results.json'
+
+def make_keys(dist, n, seed=42):
+    """
+    n distinct key numbers in arrival order: 'sequential' ascending, 'random' uniform over 10n,
+    'skewed' 80% inside one hot band (a tenth of the key space), the rest spread over the remainder.
+    """
+    rnd = random.Random(seed)
+    if dist == 'sequential': return list(range(1, n + 1))
+    if dist == 'random': return rnd.sample(range(1, n * 10), n)
+    hot, lo = int(n * 0.8), rnd.randrange(1, n * 9)
+    keys = rnd.sample(range(lo, lo + n), hot) + [x + n if x >= lo else x for x in rnd.sample(range(1, n * 9), n - hot)]
+    rnd.shuffle(keys)
+    return keys
+
+def key_name(i): return f"BK-{i:08d}"
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1)))]
+
+def measure(op, args, mem_ops=SUITE_MEMORY_OPS):
+    """
+    Runs op(arg) for every arg: the first mem_ops under tracemalloc (peak bytes above the live heap),
+    the rest timed one by one. op may return a size in bytes (HTTP response) to be averaged.
+    """
+    gc.collect()
+    peak = 0
+    tracemalloc.start()
+    for a in args[:mem_ops]:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        op(a)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    lat, sizes = [], []
+    for a in args[mem_ops:]:
+        t0 = time.perf_counter_ns()
+        size = op(a)
+        lat.append(time.perf_counter_ns() - t0)
+        if size is not None: sizes.append(size)
+    lat.sort()
+    total = sum(lat) / 1e9
+    return {'ops': len(lat), 'seconds': round(total, 6), 'ops_per_s': round(len(lat) / total, 1) if total else None,
+            'p50_us': round(percentile(lat, 50) / 1e3, 2), 'p99_us': round(percentile(lat, 99) / 1e3, 2),
+            'mean_us': round(total / len(lat) * 1e6, 2), 'peak_bytes': peak,
+            'response_bytes': round(sum(sizes) / len(sizes)) if sizes else None}
+
+def tree_ops(tree, trace):
+    """BTree methods under test; 'search' is search() with tracing off and search_with_animation() with it on."""
+    search = (lambda ma: tree.search_with_animation(ma, trace=True)) if trace else tree.search
+    return {'search': lambda ma: search(ma) and None,
+            'range': lambda r: tree.search_range_optimized(*r, trace=trace) and None,
+            'insert': lambda book: tree.insert(book, trace=trace) and None,
+            'delete': lambda ma: tree.delete(ma, trace=trace) and None}
+
+def http_ops(client, trace):
+    """The Flask routes for the same operations; returns the response body size."""
+    q = f"?trace={int(trace)}"
+    return {'search': lambda ma: len(client.get(f"/api/books/search/{ma}{q}").data),
+            'range': lambda r: len(client.post(f"/api/books/range{q}", json={'min_key': r[0], 'max_key': r[1]}).data),
+            'insert': lambda book: len(client.post(f"/api/books{q}", json=book.to_dict()).data),
+            'delete': lambda ma: len(client.delete(f"/api/books/{ma}{q}").data)}
+
+def run_config(dist, n, m, ops, traced_ops, trace_max_n):
+    """One (distribution, N, m) cell: bulk-load the catalogue, then every operation per layer and trace setting."""
+    k = min(ops, max(1, n // 10))
+    kt = min(traced_ops, k) if n <= trace_max_n else 0
+    variants = [(layer, trace, count) for layer in ('tree', 'http') for trace, count in ((False, k), (True, kt)) if count]
+    budget = sum(count + SUITE_MEMORY_OPS for *_, count in variants)
+    keys = [key_name(i) for i in make_keys(dist, n + budget)]
+    fresh = [Book(ma, f"Sách {ma}", f"Tác giả {j % 97}") for j, ma in enumerate(keys[n:])]    # chèn theo thứ tự đến
+    base = sorted(keys[:n])
+    rnd = random.Random(n * 31 + m)
+    doomed = rnd.sample(base, budget)                  # khóa bị xóa: mỗi biến thể một phần riêng
+    rows = []
+    def row(layer, op, trace, stats, **extra):
+        rows.append({'dist': dist, 'n': n, 'm': m, 'layer': layer, 'op': op, 'trace': trace, **stats, **extra})
+        r = rows[-1]
+        cell = lambda v, spec: '' if v is None else format(v, spec)
+        print(f"{dist:>10} | {n:>9,} | {m:>4} | {layer:>4} | {op:>6} | {'on' if trace else 'off':>5} | {r['ops']:>9,} | "
+              f"{cell(r['ops_per_s'], ',.0f'):>10} | {cell(r['p50_us'], '.1f'):>9} | {cell(r['p99_us'], '.1f'):>9} | "
+              f"{r['peak_bytes'] / 2**20:>8.2f} | {cell(r['response_bytes'], ','):>12}")
+
+    books = [Book(ma, f"Sách {ma}", f"Tác giả {j % 97}") for j, ma in enumerate(base)]
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    tree = BTree.bulk_load(books, m=m)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del books
+    row('tree', 'build', False, {'ops': n, 'seconds': round(elapsed, 6), 'ops_per_s': round(n / elapsed, 1), 'p50_us': None,
+                                 'p99_us': None, 'mean_us': round(elapsed / n * 1e6, 3), 'peak_bytes': peak, 'response_bytes': None},
+        height=tree.height(), nodes=tree.node_count)
+
+    app.btree = tree
+    client = app.app.test_client()
+    cursor = 0
+    for layer, trace, count in variants:
+        take = count + SUITE_MEMORY_OPS
+        inserts, deletes = fresh[cursor:cursor + take], doomed[cursor:cursor + take]
+        cursor += take
+        starts = [rnd.randrange(max(1, n - RANGE_SPAN)) for _ in range(take)]
+        workload = {'search': [rnd.choice(base) for _ in range(take)],
+                    'range': [(base[i], base[min(n, i + RANGE_SPAN) - 1]) for i in starts],
+                    'insert': inserts, 'delete': deletes}
+        fns = tree_ops(tree, trace) if layer == 'tree' else http_ops(client, trace)
+        for op in ('search', 'range', 'insert', 'delete'):
+            row(layer, op, trace, measure(fns[op], workload[op]))
+    assert tree.size == n, "cây lệch sau benchmark"    # mỗi khóa chèn vào đều có một khóa bị xóa tương ứng
+    return rows
+
+def git_revision():
+    try: return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError: return None
+
+def bench_suite(argv=None):
+    """
+    Reproducible benchmark matrix (fixed seeds): distribution x N x m x {BTree method, Flask route} x trace on/off.
+    Prints a table and writes every row plus run metadata to a JSON file for 'compare'.
+    """
+    ints = lambda s: [int(x) for x in s.split(',')]
+    p = argparse.ArgumentParser(prog='benchmark.py suite', description=bench_suite.__doc__)
+    p.add_argument('--sizes', type=ints, default=SUITE_SIZES, help="N, vd. 1000,10000")
+    p.add_argument('--degrees', type=ints, default=SUITE_DEGREES, help="bậc m, vd. 5,64")
+    p.add_argument('--dist', type=lambda s: s.split(','), default=list(DISTRIBUTIONS), help=','.join(DISTRIBUTIONS))
+    p.add_argument('--ops', type=int, default=SUITE_OPS)
+    p.add_argument('--traced-ops', type=int, default=SUITE_TRACED_OPS)
+    p.add_argument('--trace-max-n', type=int, default=SUITE_TRACE_MAX_N)
+    p.add_argument('--out', default=SUITE_OUT)
+    args = p.parse_args(sys.argv[2:] if argv is None else argv)
+    if unknown := set(args.dist) - set(DISTRIBUTIONS): p.error(f"phân bố không hợp lệ: {', '.join(unknown)}")
+
+    tmp = tempfile.mkdtemp()
+    saved = app.btree, app.wal
+    app.wal = app.WriteAheadLog(os.path.join(tmp, 'wal'), os.path.join(tmp, 'snap.bin'), compact_bytes=float('inf'), sync=False)
+    print(f"{'phân bố':>10} | {'N':>9} | {'m':>4} | {'tầng':>4} | {'thao tác':>6} | {'trace':>5} | {'số op':>9} | "
+          f"{'op/s':>10} | {'p50 (µs)':>9} | {'p99 (µs)':>9} | {'RAM (MB)':>8} | {'phản hồi (B)':>12}")
+    rows = []
+    try:
+        for dist in args.dist:
+            for n in args.sizes:
+                for m in args.degrees:
+                    rows += run_config(dist, n, m, args.ops, args.traced_ops, args.trace_max_n)
+                    app.btree = None
+    finally:
+        app.btree, app.wal = saved
+    meta = {'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'revision': git_revision(), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'args': vars(args), 'memory_ops': SUITE_MEMORY_OPS,
+            'range_span': RANGE_SPAN}
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': rows}, f, ensure_ascii=False, indent=1)
+    print(f"Đã ghi {len(rows)} dòng kết quả vào {args.out}")
+
+COMPARE_KEY = ('dist', 'n', 'm', 'layer', 'op', 'trace')
+
+def bench_compare(argv=None):
+    """
+    Compares two suite result files row by row (p50 latency, throughput, peak memory, response size).
+    Exits with status 1 when any metric got worse by more than --threshold, so it can gate a CI job.
+    """
+    p = argparse.ArgumentParser(prog='benchmark.py compare', description=bench_compare.__doc__)
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=0.10, help="tỉ lệ chậm đi chấp nhận được (0.10 = 10%%)")
+    args = p.parse_args(sys.argv[2:] if argv is None else argv)
+    def load(path):
+        with open(path, 'r', encoding='utf-8') as f: doc = json.load(f)
+        return doc['meta'], {tuple(r[c] for c in COMPARE_KEY): r for r in doc['results']}
+    (old_meta, old), (new_meta, new) = load(args.old), load(args.new)
+    print(f"{old_meta.get('revision')} -> {new_meta.get('revision')}, ngưỡng {args.threshold:.0%}")
+    # (chỉ số, lớn hơn là tốt hơn?)
+    metrics = (('p50_us', False), ('p99_us', False), ('ops_per_s', True), ('peak_bytes', False), ('response_bytes', False))
+    regressions = 0
+    for key in sorted(old.keys() & new.keys(), key=str):
+        for metric, higher_better in metrics:
+            a, b = old[key].get(metric), new[key].get(metric)
+            if not a or b is None: continue
+            change = (a - b) / a if higher_better else (b - a) / a      # > 0: tệ hơn
+            if change > args.threshold:
+                regressions += 1
+                print(f"CHẬM HƠN  {'/'.join(map(str, key))}: {metric} {a:g} -> {b:g} ({change:+.0%})")
+            elif change < -args.threshold:
+                print(f"NHANH HƠN {'/'.join(map(str, key))}: {metric} {a:g} -> {b:g} ({change:+.0%})")
+    missing = len(old.keys() ^ new.keys())
+    print(f"{len(old.keys() & new.keys())} dòng so sánh, {regressions} chỉ số tệ hơn" + (f", {missing} dòng chỉ có ở một file" if missing else ""))
+    if regressions: sys.exit(1)
+
+MODES = {'lookup': bench_lookup, 'stress': stress, 'snapshot': bench_snapshot, 'memory': bench_memory,
+         'parallel': bench_parallel, 'suite': bench_suite, 'compare': bench_compare}
+
+if __name__ == "__main__":
+    MODES[sys.argv[1] if len(sys.argv) > 1 else 'lookup']()
@@ -1,6 +1,8 @@
 # File: generate_sample.py
+# Chạy: python generate_data.py [số sách] [file]; file .jsonl được ghi từng dòng (dùng cho import_catalogue.py)
 import json
 import random
+import sys
 
 SAMPLE_FILE = 'sample_books.json'
 TOTAL_BOOKS = 100
@@ -12,17 +14,20 @@ last_names = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan"
 middle_names = ["Văn", "Thị", "Hữu", "Đức", "Thành", "Ngọc", "Minh", "Quốc", "Gia", "Xuân"]
 first_names = ["An", "Bình", "Cường", "Dũng", "Giang", "Hải", "Hùng", "Khánh", "Long", "Nam", "Phúc", "Quân", "Sơn"]
 
-def generate_samples():
-    books = []
-    for i in range(1, TOTAL_BOOKS + 1):
+def iter_samples(total):
+    for i in range(1, total + 1):
         ma_sach = f"B{i:03d}" # B001, B002...
         ten_sach = f"{random.choice(titles_prefix)} {random.choice(topics)} {random.choice(titles_suffix)}"
         tac_gia = f"{random.choice(last_names)} {random.choice(middle_names)} {random.choice(first_names)}"
-        books.append({"ma_sach": ma_sach, "ten_sach": ten_sach, "tac_gia": tac_gia})
-    
-    with open(SAMPLE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(books, f, ensure_ascii=False, indent=2)
-    print(f"Đã tạo {TOTAL_BOOKS} sách mẫu vào '{SAMPLE_FILE}'")
+        yield {"ma_sach": ma_sach, "ten_sach": ten_sach, "tac_gia": tac_gia}
+
+def generate_samples(total=TOTAL_BOOKS, path=SAMPLE_FILE):
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            # Từng dòng một: không giữ cả danh sách trong bộ nhớ
+            for book in iter_samples(total): f.write(json.dumps(book, ensure_ascii=False) + '\n')
+        else: json.dump(list(iter_samples(total)), f, ensure_ascii=False, indent=2)
+    print(f"Đã tạo {total} sách mẫu vào '{path}'")
 
 if __name__ == "__main__":
-    generate_samples()
\ No newline at end of file
+    generate_samples(int(sys.argv[1]) if len(sys.argv) > 1 else TOTAL_BOOKS, sys.argv[2] if len(sys.argv) > 2 else SAMPLE_FILE)
\ No newline at end of file
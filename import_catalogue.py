@@ -0,0 +1,35 @@
+# File: import_catalogue.py
+# Nhập catalogue rất lớn theo luồng (JSON lines, mảng JSON hoặc file export của /api/export)
+# Chạy: python import_catalogue.py <file|-> [m] [số bản ghi mỗi run]
+import sys
+import time
+
+import app
+
+PHASES = {'sort': 'Đọc & sắp xếp', 'build': 'Dựng cây'}
+
+def report(phase, count):
+    print(f"\r{PHASES[phase]}: {count:,} bản ghi", end='', file=sys.stderr, flush=True)
+
+def import_file(path, m=None, chunk=app.IMPORT_CHUNK):
+    """Replaces the catalogue with the file's books (bounded memory), then writes one snapshot."""
+    t0 = time.perf_counter()
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        with app._gc_paused():
+            books, m = app.sorted_catalogue(f, m=m, chunk=chunk, progress=report)
+            t_sort = time.perf_counter() - t0
+            print(file=sys.stderr)
+            app.btree.close()
+            app.btree = app._attach_indexes(app._new_tree(books, m=m, progress=report))
+            print(file=sys.stderr)
+    finally:
+        if f is not sys.stdin: f.close()
+    app.save_data()
+    print(f"Đã nhập {app.btree.size:,} cuốn (m={m}, {app.btree.node_count:,} node): "
+          f"sắp xếp {t_sort:.1f}s, tổng {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2: sys.exit("Cách dùng: python import_catalogue.py <file|-> [m] [số bản ghi mỗi run]")
+    import_file(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None,
+                int(sys.argv[3]) if len(sys.argv) > 3 else app.IMPORT_CHUNK)
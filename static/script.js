@@ -1,7 +1,9 @@
 // --- CẤU HÌNH & CSS ---
-const CONFIG = { NODE_SPACING: 40, LEVEL_HEIGHT: 120 };
+const CONFIG = { NODE_SPACING: 40, LEVEL_HEIGHT: 120, BOOK_PAGE_SIZE: 100, TREE_DEPTH: 4, TREE_EXPAND_DEPTH: 2, STUB_WIDTH: 150 };
 
 let panzoomInstance = null;
+let bookNextAfter = null; // Token trang kế tiếp của bảng sách (ma_sach cuối trang hiện tại)
+let treeView = null;      // Cây đang hiển thị: chỉ TREE_DEPTH tầng trên cùng, phần dưới là stub (mở khi bấm)
 
 // Inject CSS styles dynamically
 const style = document.createElement('style');
@@ -74,6 +76,10 @@ style.innerHTML = `
         box-shadow: none !important;
     }
 
+    /* [STUB] Nhánh thu gọn: bấm để tải thêm */
+    .node-stub { background-color: #f1f5f9 !important; border: 2px dashed #94a3b8 !important; color: #475569; cursor: pointer; }
+    .node-stub:hover { border-color: #6366f1 !important; color: #4338ca; }
+
     /* --- ANIMATIONS --- */
     @keyframes shake { 0% { transform: translateX(0); } 25% { transform: translateX(-5px); } 50% { transform: translateX(5px); } 75% { transform: translateX(-5px); } 100% { transform: translateX(0); } }
     @keyframes pulse-red {
@@ -92,6 +98,7 @@ class AnimationManager {
         this.isPlaying = false;
         this.timer = null;
         this.targetKey = null; 
+        this.streaming = false;   // true khi server vẫn đang gửi thêm bước (NDJSON)
         
         this.controlsDiv = document.getElementById('animationControls');
         this.msgEl = document.getElementById('animMessage');
@@ -103,6 +110,7 @@ class AnimationManager {
     start(steps, targetKey = null, startAtEnd = false) {
         if (!steps || steps.length === 0) return;
         this.steps = steps;
+        this.frameCache = { index: -1, nodes: null, rootId: null };
         this.targetKey = targetKey;
         this.currentIndex = startAtEnd ? this.steps.length - 1 : 0;
         this.isPlaying = false;
@@ -112,6 +120,35 @@ class AnimationManager {
         this.renderStep();
     }
 
+    // Gọi API ở chế độ stream: phát các bước đầu ngay khi tới, các bước sau được nối dần vào. Trả về dòng kết quả cuối ('done').
+    async startStream(url, options = {}, targetKey = null) {
+        const res = await fetch(url, options);
+        const reader = res.body.getReader(); const decoder = new TextDecoder();
+        let buffer = '', result = null, started = false;
+        const handle = (line) => {
+            if (!line.trim()) return;
+            let msg;
+            try { msg = JSON.parse(line); }
+            catch (e) { if (res.ok) throw e; result = { success: false, message: `Lỗi máy chủ (${res.status})` }; return; }
+            // Dòng kết thúc, hoặc body JSON lỗi thường (vd. 400) không có 'step'
+            if (msg.done || !msg.step) { result = msg; return; }
+            if (!started) { started = true; this.start([msg.step], targetKey, false); this.play(); }
+            else { this.steps.push(msg.step); this.counterEl.innerText = `${this.currentIndex + 1} / ${this.steps.length}…`; }
+        };
+        this.streaming = true;
+        try {
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n'); buffer = lines.pop();
+                lines.forEach(handle);
+            }
+            handle(buffer + decoder.decode());     // Phần còn lại không có '\n' cuối
+        } finally { this.streaming = false; }
+        return result || { success: false, message: 'Mất kết nối' };
+    }
+
     renderStep() {
         if (this.currentIndex < 0 || this.currentIndex >= this.steps.length) return;
         const step = this.steps[this.currentIndex];
@@ -122,7 +159,27 @@ class AnimationManager {
         this.progressEl.style.width = `${pct}%`;
         
         // Vẽ cây với đầy đủ tham số
-        drawTreeProfessional(step.tree, step.highlights, this.targetKey, step.message, step.found_keys); 
+        drawTreeProfessional(this.treeAt(this.currentIndex), step.highlights, this.targetKey, step.message, step.found_keys); 
+    }
+
+    // Dựng lại cây của bước `index` từ snapshot gốc + các delta (server chỉ gửi node thay đổi)
+    treeAt(index) {
+        let cache = this.frameCache;
+        if (index < cache.index) cache = { index: -1, nodes: null, rootId: null };
+        let nodes = cache.nodes ? new Map(cache.nodes) : new Map();
+        let rootId = cache.rootId;
+        for (let i = cache.index + 1; i <= index; i++) {
+            const step = this.steps[i];
+            if (step.tree) {
+                nodes = new Map(); rootId = step.tree.id;
+                flattenTree(step.tree, nodes);
+            } else if (step.delta) {
+                step.delta.nodes.forEach(n => nodes.set(n.id, n));
+                rootId = step.delta.root;
+            }
+        }
+        this.frameCache = { index: index, nodes: nodes, rootId: rootId };
+        return buildTreeFromNodes(nodes, rootId);
     }
 
     next() { if (this.currentIndex < this.steps.length - 1) { this.currentIndex++; this.renderStep(); } else { this.stop(); } }
@@ -142,7 +199,8 @@ class AnimationManager {
                     // Tăng thời gian chờ cho các bước quan trọng
                     if (["Gộp", "Tách", "Thay thế", "Mượn", "Hạ gốc", "Batch Scan", "Disk I/O", "HOÀN TẤT", "Tràn", "Trung vị", "TÌM THẤY"].some(kw => msg.includes(kw))) delay = 2500; 
                     this.timer = setTimeout(runNextStep, delay);
-                } else { this.stop(); }
+                } else if (this.streaming) { this.timer = setTimeout(runNextStep, 200); } // Chờ bước kế tiếp từ server
+                else { this.stop(); }
             };
             runNextStep();
         }
@@ -155,6 +213,17 @@ class AnimationManager {
 }
 const animManager = new AnimationManager();
 
+function flattenTree(node, map) {
+    map.set(node.id, { id: node.id, keys: node.keys, leaf: node.leaf, children: (node.children || []).map(c => c.id) });
+    (node.children || []).forEach(c => flattenTree(c, map));
+}
+
+function buildTreeFromNodes(nodes, id) {
+    const n = nodes.get(id);
+    if (!n) return null;
+    return { id: n.id, keys: n.keys, leaf: n.leaf, children: n.children.map(c => buildTreeFromNodes(nodes, c)).filter(Boolean) };
+}
+
 // --- KHỞI TẠO & EVENTS ---
 document.addEventListener('DOMContentLoaded', () => { loadAllData(); setupEventListeners(); });
 
@@ -199,15 +268,30 @@ function setupEventListeners() {
 // --- API FUNCTIONS ---
 async function loadAllData(affectedNodesList = null, newlyAddedBookId = null, searchPath = null, skipTreeDraw = false, highlightKey = null) {
     try {
-        const [booksRes, treeRes] = await Promise.all([ fetch(`/api/books?t=${Date.now()}`), fetch(`/api/tree?t=${Date.now()}`) ]);
-        const books = await booksRes.json(); const treeRoot = await treeRes.json();
-        renderBookTable(books);
-        document.getElementById('bookCount').innerText = books.length;
+        const [booksRes, treeRes] = await Promise.all([ fetch(`/api/books?limit=${CONFIG.BOOK_PAGE_SIZE}`), fetch(`/api/tree?depth=${CONFIG.TREE_DEPTH}`) ]);
+        const page = await booksRes.json(); const treeRoot = await treeRes.json();
+        treeView = treeRoot;
+        bookNextAfter = page.next_after;
+        renderBookTable(page.books);
+        document.getElementById('bookCount').innerText = page.total;
         if (treeRoot.m) document.getElementById('degreeInput').value = treeRoot.m;
         if (!skipTreeDraw) drawTreeProfessional(treeRoot, affectedNodesList, newlyAddedBookId, null);
     } catch (e) { console.error(e); }
 }
 
+// Mở một nhánh thu gọn: tải TREE_EXPAND_DEPTH tầng của cây con rồi ghép vào đúng chỗ stub
+async function expandStub(stub) {
+    try {
+        const res = await fetch(`/api/tree?depth=${CONFIG.TREE_EXPAND_DEPTH}&root=${stub.path.join('.')}`);
+        const sub = await res.json();
+        if (sub.success === false || !treeView || sub.version !== treeView.version) return loadAllData(); // Cây đã đổi: tải lại
+        delete sub.m; delete sub.version;
+        Object.keys(stub).forEach(k => delete stub[k]);
+        Object.assign(stub, sub);
+        drawTreeProfessional(treeView, [stub.keys.map(k => k.ma_sach)]);
+    } catch (e) { showNotification('Lỗi tải nhánh', 'error'); }
+}
+
 async function addBook(bookData, newBookId) {
     try {
         const res = await fetch('/api/books', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(bookData) });
@@ -233,9 +317,9 @@ async function addRandomBook(btn) {
 async function generateBulkBooks(btn) {
     const original = btn.innerHTML; btn.innerHTML = '...'; btn.disabled = true;
     try {
-        const res = await fetch('/api/books/generate_bulk', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ count: 10 }) });
-        const data = await res.json();
-        if (data.success) { showNotification(data.message, 'success'); await loadAllData(null, null, null, false); switchTab('tree'); } else showNotification(data.message, 'error');
+        switchTab('tree');
+        const data = await animManager.startStream('/api/books/generate_bulk?stream=1', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ count: 10 }) });
+        if (data.success) { showNotification(data.message, 'success'); await loadAllData(null, null, null, true); } else showNotification(data.message, 'error');
     } catch (e) { showNotification('Lỗi', 'error'); } finally { btn.innerHTML = original; btn.disabled = false; }
 }
 
@@ -256,30 +340,23 @@ async function searchBook(ma) {
 
 async function deleteBookById(ma) {
     try {
-        const res = await fetch(`/api/books/${ma}`, { method: 'DELETE' }); const data = await res.json();
-        if (data.success) {
-            showNotification(data.message, 'success'); switchTab('tree');
-            if (data.steps && data.steps.length > 0) { animManager.start(data.steps, ma, false); animManager.play(); await loadAllData(null, null, null, true); } 
-            else { document.getElementById('animationControls').classList.add('hidden'); await loadAllData(data.affected_nodes, null); }
-        } else showNotification(data.message, 'error');
+        switchTab('tree');
+        const data = await animManager.startStream(`/api/books/${encodeURIComponent(ma)}?stream=1`, { method: 'DELETE' }, ma);
+        if (data.success) { showNotification(data.message, 'success'); await loadAllData(null, null, null, true); }
+        else showNotification(data.message, 'error');
     } catch (e) { showNotification('Lỗi xóa', 'error'); }
 }
 
 async function executeRangeSearch(min, max) {
     try {
-        const res = await fetch('/api/books/range', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({min_key: min, max_key: max})});
-        const data = await res.json();
+        switchTab('tree'); 
+        const data = await animManager.startStream('/api/books/range?stream=1', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({min_key: min, max_key: max})});
         
         if(data.success) {
-            switchTab('tree'); 
             const resultDiv = document.getElementById('searchResult');
             if(resultDiv) {
                 resultDiv.innerHTML = `<div class="p-3 bg-green-50 text-green-900 border-green-200 border rounded text-sm shadow-sm">${data.message}</div>`;
             }
-            if(data.steps && data.steps.length > 0) { 
-                animManager.start(data.steps, null, false); 
-                animManager.play(); 
-            }
         } else { 
             showNotification(data.message, 'error'); 
         }
@@ -370,7 +447,15 @@ function drawTreeProfessional(root, affectedNodesList = null, targetKey = null,
         nodeEl.style.left = `${node.realX}px`; 
         nodeEl.style.top = `${node.realY}px`; 
 
-        const keys = node.data.keys || [];
+        if (node.data.stub) {
+            const s = node.data;
+            nodeEl.className = 'btree-node-group absolute node-stub rounded-xl shadow px-2 py-1 text-xs text-center leading-tight';
+            nodeEl.style.width = `${node.width}px`;
+            nodeEl.innerHTML = `<div class="font-bold"><i class="bi bi-plus-circle"></i> ${s.size} sách</div><div class="whitespace-nowrap overflow-hidden text-ellipsis">${s.min_key ?? ''} … ${s.max_key ?? ''}</div>`;
+            nodeEl.title = 'Bấm để mở nhánh';
+            nodeEl.addEventListener('click', () => expandStub(s));
+        }
+        const keys = node.data.stub ? [] : (node.data.keys || []);
         const currentNodeSignature = keys.map(k => k.ma_sach || k).join(',');
 
         // 1. HIGHLIGHT NODE
@@ -385,7 +470,7 @@ function drawTreeProfessional(root, affectedNodesList = null, targetKey = null,
                 if (!targetNodeData) targetNodeData = node;
             }
         }
-        if (keys.length === 0) { nodeEl.style.width = '20px'; nodeEl.style.height = '20px'; nodeEl.classList.add('bg-slate-500'); }
+        if (keys.length === 0 && !node.data.stub) { nodeEl.style.width = '20px'; nodeEl.style.height = '20px'; nodeEl.classList.add('bg-slate-500'); }
 
         // 2. HIGHLIGHT KEYS
         keys.forEach(key => {
@@ -462,17 +547,32 @@ function focusOnNode(x, y, w, h) {
     panzoomInstance.pan(targetX, targetY, { animate: true, duration: 600 });
 }
 
-function renderBookTable(books) {
+function renderBookTable(books, append = false) {
     const tbody = document.getElementById('bookTableBody');
-    if (!books || books.length === 0) { tbody.innerHTML = `<tr><td colspan="5" class="text-center py-8 text-gray-400">Trống</td></tr>`; return; }
-    tbody.innerHTML = books.map(b => `<tr class="hover:bg-gray-100 border-b"><td class="px-4 py-3 font-bold text-indigo-600">${b.ma_sach}</td><td class="px-4 py-3">${b.ten_sach}</td><td class="px-4 py-3">${b.tac_gia}</td><td class="px-4 py-3 text-center"><button onclick="if(confirm('Xóa?')) deleteBookById('${b.ma_sach}')" class="text-red-500 hover:text-red-700"><i class="bi bi-trash"></i></button></td></tr>`).join('');
+    document.getElementById('bookTableMore')?.remove();
+    if (!append && (!books || books.length === 0)) { tbody.innerHTML = `<tr><td colspan="5" class="text-center py-8 text-gray-400">Trống</td></tr>`; return; }
+    const rows = books.map(b => `<tr class="hover:bg-gray-100 border-b"><td class="px-4 py-3 font-bold text-indigo-600">${b.ma_sach}</td><td class="px-4 py-3">${b.ten_sach}</td><td class="px-4 py-3">${b.tac_gia}</td><td class="px-4 py-3 text-center"><button onclick="if(confirm('Xóa?')) deleteBookById('${b.ma_sach}')" class="text-red-500 hover:text-red-700"><i class="bi bi-trash"></i></button></td></tr>`).join('');
+    if (append) tbody.insertAdjacentHTML('beforeend', rows); else tbody.innerHTML = rows;
+    if (bookNextAfter) tbody.insertAdjacentHTML('beforeend', `<tr id="bookTableMore"><td colspan="5" class="text-center py-3"><button onclick="loadMoreBooks(this)" class="px-4 py-2 border border-indigo-400 text-indigo-600 rounded font-bold hover:bg-indigo-50 text-sm"><i class="bi bi-chevron-double-down"></i> Tải thêm</button></td></tr>`);
+}
+
+// Tải trang kế tiếp của bảng sách theo token 'after' (không tải lại toàn bộ kho)
+async function loadMoreBooks(btn) {
+    if (!bookNextAfter) return;
+    btn.disabled = true; btn.innerHTML = '...';
+    try {
+        const res = await fetch(`/api/books?limit=${CONFIG.BOOK_PAGE_SIZE}&after=${encodeURIComponent(bookNextAfter)}`);
+        const page = await res.json();
+        bookNextAfter = page.next_after;
+        renderBookTable(page.books, true);
+    } catch (e) { showNotification('Lỗi tải trang', 'error'); btn.disabled = false; }
 }
 
 function calculateTreeLayout(root) {
     let nodes = []; let maxDepth = 0; const KEY_WIDTH = 66; 
     function traverse(node, depth, parent) {
         if (!node) return null; maxDepth = Math.max(maxDepth, depth);
-        const computedWidth = (node.keys.length * KEY_WIDTH) + 16;
+        const computedWidth = node.stub ? CONFIG.STUB_WIDTH : (node.keys.length * KEY_WIDTH) + 16;
         const processedNode = { data: node, depth: depth, parent: parent, children: [], width: computedWidth, height: 50, x: 0, y: depth * CONFIG.LEVEL_HEIGHT };
         if (node.children) { node.children.forEach(child => { const c = traverse(child, depth + 1, processedNode); if (c) processedNode.children.push(c); }); }
         nodes.push(processedNode); return processedNode;